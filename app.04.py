@@ -36,11 +36,13 @@ app.layout = html.Div([
     dcc.Graph(
         id='example-04',
         figure={
+            # one groupby split instead of filtering the frame for every
+            # field of every trace
             'data': [
                 dict(
-                    x=df[df['continent'] == i]['gdp per capita'],
-                    y=df[df['continent'] == i]['life expectancy'],
-                    text=df[df['continent'] == i]['country'],
+                    x=group['gdp per capita'],
+                    y=group['life expectancy'],
+                    text=group['country'],
                     mode='markers',
                     opacity=0.7,
                     marker={
@@ -48,7 +50,7 @@ app.layout = html.Div([
                         'line': {'width': 0.5, 'color': 'white'}
                     },
                     name=i
-                ) for i in df.continent.unique()
+                ) for i, group in df.groupby('continent', sort=False)
             ],
             'layout': dict(
                 xaxis={'type': 'log', 'title': 'GDP Per Capita'},
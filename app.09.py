@@ -51,6 +51,10 @@ There are a few nice patterns in this example:
 df = pd.read_csv(
     'https://raw.githubusercontent.com/plotly/datasets/master/gapminderDataFiveYear.csv')
 
+# split the dataframe by year once at startup so that moving the slider is a
+# dictionary lookup rather than a scan over every row.
+df_by_year = {year: group for year, group in df.groupby('year')}
+
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
@@ -72,10 +76,9 @@ app.layout = html.Div([
     Output('graph-with-slider', 'figure'),
     [Input('year-slider', 'value')])
 def update_figure(selected_year):
-    filtered_df = df[df.year == selected_year]
+    filtered_df = df_by_year[selected_year]
     traces = []
-    for i in filtered_df.continent.unique():
-        df_by_continent = filtered_df[filtered_df['continent'] == i]
+    for i, df_by_continent in filtered_df.groupby('continent', sort=False):
         traces.append(dict(
             x=df_by_continent['gdpPercap'],
             y=df_by_continent['lifeExp'],
@@ -4,6 +4,8 @@ import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
 
+from unchanged_outputs import skip_unchanged_outputs
+
 """
 Part 3D: Multiple Outputs
 
@@ -24,6 +26,11 @@ A word of caution: it's not always a good idea to combine Outputs, even if you c
 
 - If they have the same Inputs but do independent computations with these inputs,
   keeping the callbacks separate can allow them to run in parallel.
+
+A multi-output callback sends every output back to the browser on every call,
+even the ones whose value didn't change. Registering it with skip_unchanged_outputs
+(see unchanged_outputs.py) instead of app.callback only sends the outputs whose
+value changed: a hash of the outputs the browser has is kept in a dcc.Store.
 """
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
@@ -47,10 +54,13 @@ app.layout = html.Div([
             html.Tr([html.Td(['x', html.Sup('x')]), html.Td(id='x^x')])
         ])
     ]),
+    # the hashes of the values shown in the table
+    dcc.Store(id='table-hashes'),
 ])
 
 
-@app.callback(
+@skip_unchanged_outputs(
+    app, 'table-hashes',
     [Output('square', 'children'),
      Output('cube', 'children'),
      Output('twos', 'children'),
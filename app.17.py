@@ -5,7 +5,7 @@ from textwrap import dedent as d
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output
 
 """
 Part 5A: Interactive Visualizations (Basic)
@@ -32,6 +32,12 @@ These properties update when you hover over points, click on points,
 or select regions of points in a graph.
 
 Here's an simple example that prints these attributes in the screen.
+
+Note that selectedData holds one entry per selected point, so a box select over
+a dense plot would post a request that grows with the selection. In this example
+a clientside callback (assets/selection_geometry.js) keeps only the geometry of
+the selection (the box `range` or the `lassoPoints` polygon) in a dcc.Store, and
+that store is what gets sent to the server.
 """
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
@@ -104,8 +110,12 @@ app.layout = html.Div([
                 Note that if `layout.clickmode = 'event+select'`, selection data also
                 accumulates (or un-accumulates) selected data if you hold down the shift
                 button while clicking.
+
+                Only the geometry of the selection is sent to the server.
             """)),
             html.Pre(id='selected-data', style=styles['pre']),
+            # the geometry of the selection, see assets/selection_geometry.js
+            dcc.Store(id='selected-geometry'),
         ], className='three columns'),
 
         html.Div([
@@ -137,11 +147,17 @@ def display_click_data(clickData):
     return json.dumps(clickData, indent=2)
 
 
+app.clientside_callback(
+    ClientsideFunction(namespace='selection', function_name='geometry'),
+    Output('selected-geometry', 'data'),
+    [Input('basic-interactions', 'selectedData')])
+
+
 @app.callback(
     Output('selected-data', 'children'),
-    [Input('basic-interactions', 'selectedData')])
-def display_selected_data(selectedData):
-    return json.dumps(selectedData, indent=2)
+    [Input('selected-geometry', 'data')])
+def display_selected_data(selectedGeometry):
+    return json.dumps(selectedGeometry, indent=2)
 
 
 @app.callback(
@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
+import functools
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import numpy as np
 import pandas as pd
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output
+
+from unchanged_outputs import skip_unchanged_outputs
 
 """
 PART 5C: Generic Crossfilter Recipe
@@ -18,6 +22,26 @@ regions of each plot. A pandas dataframe is filtered based off of the selected
 points and the graphs are replotted with the selected points highlighted and
 the selected region drawn as a dashed rectangle.
 
+- Each graph's selection is resolved into the sorted numbers of the rows inside
+  it, and the selections are intersected, so the work of an update grows with the
+  selections rather than with the dataframe and linked brushing stays interactive
+  on millions of points.
+
+- Every column is sorted once at startup, so the rows inside a selection range
+  are found by binary search and the default selection bounds come from cached
+  column statistics rather than from a scan of the whole column.
+
+- When a selection changes only some of the figures, the others are not sent
+  again: the callback is registered with skip_unchanged_outputs (see
+  unchanged_outputs.py), which keeps a hash of the figures the browser has in a
+  dcc.Store and replaces the unchanged ones with dash.no_update.
+
+- The graphs' selectedData is never posted to the server. It holds one entry per
+  selected point, so the request would grow with the selection. Instead, a
+  clientside callback (assets/selection_geometry.js) copies only the geometry of
+  the selection (the box `range` or the `lassoPoints` polygon) into a dcc.Store,
+  and the server resolves which rows are inside it with vectorized tests.
+
 - As an aside, if you find yourself filtering and visualizing highly-dimensional
 datasets, you should consider checking out the parallel coordinates chart type.
 
@@ -38,6 +62,15 @@ app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 np.random.seed(0)
 df = pd.DataFrame({"Col " + str(i + 1): np.random.rand(30) for i in range(6)})
 
+# sort every column once at startup. `column_order[col]` holds the row numbers
+# of `df` in ascending order of `col`, so the rows inside a range are a single
+# slice of it found by binary search. the column statistics are read off the
+# ends of the sorted values instead of being recomputed on every update.
+column_order = {col: np.argsort(df[col].values, kind='mergesort') for col in df}
+sorted_values = {col: df[col].values[column_order[col]] for col in df}
+column_stats = {col: {'min': sorted_values[col][0], 'max': sorted_values[col][-1]}
+                for col in df}
+
 app.layout = html.Div([
     html.Div(
         dcc.Graph(id='g1', config={'displayModeBar': False}),
@@ -50,19 +83,47 @@ app.layout = html.Div([
     html.Div(
         dcc.Graph(id='g3', config={'displayModeBar': False}),
         className='four columns'
-    )
+    ),
+
+    # the geometry of each graph's selection, see assets/selection_geometry.js
+    dcc.Store(id='g1-selection'),
+    dcc.Store(id='g2-selection'),
+    dcc.Store(id='g3-selection'),
+    # the hashes of the figures the browser has
+    dcc.Store(id='figure-hashes')
 ], className='row')
 
+for graph_id in ['g1', 'g2', 'g3']:
+    app.clientside_callback(
+        ClientsideFunction(namespace='selection', function_name='geometry'),
+        Output(graph_id + '-selection', 'data'),
+        [Input(graph_id, 'selectedData')]
+    )
+
 
 def get_figure(df, x_col, y_col, selectedpoints, selectedpoints_local):
 
-    if selectedpoints_local and selectedpoints_local['range']:
+    if selectedpoints_local and selectedpoints_local.get('range'):
         ranges = selectedpoints_local['range']
         selection_bounds = {'x0': ranges['x'][0], 'x1': ranges['x'][1],
                             'y0': ranges['y'][0], 'y1': ranges['y'][1]}
     else:
-        selection_bounds = {'x0': np.min(df[x_col]), 'x1': np.max(df[x_col]),
-                            'y0': np.min(df[y_col]), 'y1': np.max(df[y_col])}
+        selection_bounds = {'x0': column_stats[x_col]['min'],
+                            'x1': column_stats[x_col]['max'],
+                            'y0': column_stats[y_col]['min'],
+                            'y1': column_stats[y_col]['max']}
+
+    # Display a rectangle to highlight the previously selected region,
+    # or the outline of the lasso if that's how the points were selected
+    if selectedpoints_local and selectedpoints_local.get('lassoPoints'):
+        lasso = selectedpoints_local['lassoPoints']
+        selection_shape = {
+            'type': 'path',
+            'path': 'M ' + ' L '.join(
+                '{},{}'.format(x, y) for x, y in zip(lasso['x'], lasso['y'])) + ' Z'
+        }
+    else:
+        selection_shape = dict({'type': 'rect'}, **selection_bounds)
 
     # set which points are selected with the `selectedpoints` property
     # and style those points with the `selected` and `unselected`
@@ -90,33 +151,104 @@ def get_figure(df, x_col, y_col, selectedpoints, selectedpoints_local):
             'margin': {'l': 20, 'r': 0, 'b': 15, 't': 5},
             'dragmode': 'select',
             'hovermode': False,
-            # Display a rectangle to highlight the previously selected region
             'shapes': [dict({
-                'type': 'rect',
                 'line': {'width': 1, 'dash': 'dot', 'color': 'darkgrey'}
-            }, **selection_bounds
+            }, **selection_shape
             )]
         }
     }
 
+
+def points_in_polygon(x, y, polygon_x, polygon_y):
+    # even-odd ray casting, vectorized over the points: for each edge of the
+    # polygon, flip the points whose horizontal ray crosses that edge
+    inside = np.zeros(len(x), dtype=bool)
+    for xa, ya, xb, yb in zip(polygon_x, polygon_y,
+                              np.roll(polygon_x, 1), np.roll(polygon_y, 1)):
+        if ya == yb:
+            continue
+        crosses = (y < ya) != (y < yb)
+        x_cross = xa + (y - ya) * (xb - xa) / (yb - ya)
+        inside ^= crosses & (x < x_cross)
+    return inside
+
+
+def rows_in_range(col, lower, upper):
+    # binary search the sorted column for the slice of rows inside the range
+    start = np.searchsorted(sorted_values[col], lower, side='left')
+    stop = np.searchsorted(sorted_values[col], upper, side='right')
+    return column_order[col][start:stop]
+
+
+def rows_in_box(df, x_col, y_col, x0, x1, y0, y1):
+    # take the rows inside the narrower of the two ranges from its sorted index,
+    # then check only those rows against the other range
+    x_rows = rows_in_range(x_col, x0, x1)
+    y_rows = rows_in_range(y_col, y0, y1)
+    if len(x_rows) <= len(y_rows):
+        y = df[y_col].values[x_rows]
+        return x_rows[(y >= y0) & (y <= y1)]
+    x = df[x_col].values[y_rows]
+    return y_rows[(x >= x0) & (x <= x1)]
+
+
+def selected_rows(df, x_col, y_col, selection):
+    # resolve one view's selection geometry into the sorted row numbers of
+    # `df` inside it, or None when nothing is selected. box selections are
+    # resolved from the `range` bounds and lasso selections from the
+    # `lassoPoints` polygon with the sorted column indexes, so the cost
+    # depends on the size of the selection rather than of `df`.
+    if not selection:
+        return None
+
+    if selection.get('range'):
+        ranges = selection['range']
+        x0, x1 = sorted(ranges['x'])
+        y0, y1 = sorted(ranges['y'])
+        rows = rows_in_box(df, x_col, y_col, x0, x1, y0, y1)
+    elif selection.get('lassoPoints'):
+        # narrow the candidates down to the lasso's bounding box first
+        lasso_x = np.asarray(selection['lassoPoints']['x'], dtype=float)
+        lasso_y = np.asarray(selection['lassoPoints']['y'], dtype=float)
+        rows = rows_in_box(df, x_col, y_col, lasso_x.min(), lasso_x.max(),
+                           lasso_y.min(), lasso_y.max())
+        rows = rows[points_in_polygon(df[x_col].values[rows],
+                                      df[y_col].values[rows], lasso_x, lasso_y)]
+    elif selection.get('customdata'):
+        # click selections have no geometry, only the ids of the clicked points
+        return np.unique(np.asarray(selection['customdata'], dtype=np.intp))
+    else:
+        return None
+
+    # in the order of the column's values, not of the rows
+    return np.sort(rows)
+
+
 # this callback defines 3 figures
 # as a function of the intersection of their 3 selections
 
 
-@app.callback(
+@skip_unchanged_outputs(
+    app, 'figure-hashes',
     [Output('g1', 'figure'),
      Output('g2', 'figure'),
      Output('g3', 'figure')],
-    [Input('g1', 'selectedData'),
-     Input('g2', 'selectedData'),
-     Input('g3', 'selectedData')]
+    [Input('g1-selection', 'data'),
+     Input('g2-selection', 'data'),
+     Input('g3-selection', 'data')]
 )
 def callback(selection1, selection2, selection3):
-    selectedpoints = df.index
-    for selected_data in [selection1, selection2, selection3]:
-        if selected_data and selected_data['points']:
-            selectedpoints = np.intersect1d(selectedpoints,
-                                            [p['customdata'] for p in selected_data['points']])
+    # intersect the rows of the views that have a selection, so the cost
+    # scales with the selections. every row is selected when none is
+    selections = [rows for rows in [
+        selected_rows(df, "Col 1", "Col 2", selection1),
+        selected_rows(df, "Col 3", "Col 4", selection2),
+        selected_rows(df, "Col 5", "Col 6", selection3)] if rows is not None]
+    if selections:
+        selectedpoints = functools.reduce(
+            lambda a, b: np.intersect1d(a, b, assume_unique=True), selections)
+    else:
+        selectedpoints = np.arange(len(df))
 
     return [get_figure(df, "Col 1", "Col 2", selectedpoints, selection1),
             get_figure(df, "Col 3", "Col 4", selectedpoints, selection2),
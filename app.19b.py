@@ -0,0 +1,537 @@
+# -*- coding: utf-8 -*-
+import collections
+import copy
+import threading
+import uuid
+
+import dash
+import dash_core_components as dcc
+import dash_html_components as html
+import numpy as np
+import pandas as pd
+from dash.dependencies import ClientsideFunction, Input, Output
+
+"""
+PART 5D: N-Dimensional Crossfilter
+
+The previous example hard-codes three graphs over six columns and recomputes
+every selection from scratch on every update. This example generalizes it in
+the spirit of crossfilter.js (https://github.com/crossfilter/crossfilter):
+
+- A Crossfilter is declared over a dataframe. Each Dimension is a column with a
+  range filter, and each Group bins the rows of a dimension and keeps a count
+  (and optionally a sum of another column) of the rows in every bin.
+
+- Every dimension is sorted once, so moving a range filter only touches the rows
+  that enter or leave the range: they are a couple of slices of the sorted
+  index. The group aggregates are updated incrementally by adding and removing
+  just those rows instead of being recomputed over the whole dataframe.
+
+- As in crossfilter.js, a group observes every filter except the one on its own
+  dimension, so a histogram keeps showing the full distribution of its column
+  while the other views are filtered by its selection.
+
+- The views (scatter plots over two dimensions and histograms over one) generate
+  their own graphs, and a single callback keeps them all linked. Add as many
+  views as you need to the `views` list below.
+
+- Sending one point per row stops being practical after a few hundred thousand
+  rows. DensityView renders a 2-D view on the server instead: the rows are binned
+  into a grid with one cell per pixel of the plot, kept up to date incrementally
+  like the other groups, and sent as heatmaps of the selected and unselected
+  rows. Box selections on it still filter through their range, and the size of
+  the response depends on the number of pixels, not of rows.
+
+Where is the state kept?
+
+Dash callbacks must not modify global state (see Part 6). Here the filter state
+of each session is fully determined by the callback inputs: the selections of
+every view are passed to the callback on every update. The per-session
+Crossfilter is only a cache of that state that lets the update be incremental.
+A worker that doesn't have it yet (a new session, another process, or an
+evicted entry) starts from a fresh copy and reaches the same result.
+Every cached Crossfilter holds a byte per row (more past 8 dimensions) and the
+counts of its groups, a few MB for a million rows, so each process keeps the
+max_sessions most recently used ones.
+
+As in Part 5C, the graphs only post the geometry of their selection to the server
+(see assets/selection_geometry.js). Lasso selections don't map onto per-column
+range filters, so the graphs are limited to box selections.
+"""
+
+external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
+
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+
+# make a sample data frame with 6 columns
+np.random.seed(0)
+N_ROWS = 1000000
+df = pd.DataFrame({"Col " + str(i + 1): np.random.randn(N_ROWS) for i in range(6)})
+
+
+class Crossfilter(object):
+    # Range filters over the rows of a dataframe.
+    #
+    # `filters` holds one bit per dimension for every row: the bit is set when
+    # the row is outside that dimension's filter, so the rows that pass every
+    # filter are the ones where `filters == 0`. every session has its own copy,
+    # so it uses the smallest unsigned type with a bit for every dimension.
+
+    FILTER_DTYPES = [np.uint8, np.uint16, np.uint32, np.uint64]
+    MAX_DIMENSIONS = 64
+
+    def __init__(self, df):
+        self.df = df
+        self.filters = np.zeros(len(df), dtype=np.uint8)
+        self.dimensions = []
+        self.groups = []
+        self.lock = threading.Lock()
+        self._selected_rows = None
+
+    def dimension(self, column):
+        if len(self.dimensions) == self.MAX_DIMENSIONS:
+            raise ValueError('A crossfilter supports at most {} dimensions'.format(
+                self.MAX_DIMENSIONS))
+        if len(self.dimensions) == 8 * self.filters.itemsize:
+            wider = self.FILTER_DTYPES[self.FILTER_DTYPES.index(self.filters.dtype.type) + 1]
+            self.filters = self.filters.astype(wider)
+        dimension = Dimension(self, column, len(self.dimensions))
+        self.dimensions.append(dimension)
+        return dimension
+
+    def passing(self):
+        return self.filters == 0
+
+    def selected_rows(self):
+        # the rows that pass every filter, kept until the next filter change
+        if self._selected_rows is None:
+            self._selected_rows = np.flatnonzero(self.passing())
+        return self._selected_rows
+
+    def clone(self):
+        # the sorted indexes and the group codes are never modified, so they are
+        # shared with the clone. only the filter state and the aggregates are copied.
+        clone = copy.copy(self)
+        clone.filters = self.filters.copy()
+        clone.lock = threading.Lock()
+        clone.dimensions = [copy.copy(dimension) for dimension in self.dimensions]
+        for dimension in clone.dimensions:
+            dimension.crossfilter = clone
+        clone.groups = [group.clone(clone) for group in self.groups]
+        return clone
+
+    def _update(self, dimension, entering, leaving):
+        # `entering` and `leaving` are the rows that just entered or left the
+        # filter of `dimension`. flip their bit, then add and remove them from
+        # the groups of the other dimensions when they pass every other filter.
+        # groups without a dimension (grids) observe every filter.
+        bit = dimension.bit
+        self.filters[entering] &= ~bit
+        self.filters[leaving] |= bit
+        self._selected_rows = None
+        for group in self.groups:
+            if group.dimension is dimension:
+                continue
+            others = ~self.filters.dtype.type(0)
+            if group.dimension is not None:
+                others = ~group.dimension.bit
+            group.add(entering[(self.filters[entering] & others) == 0])
+            group.remove(leaving[(self.filters[leaving] & others & ~bit) == 0])
+
+
+class Dimension(object):
+    # A column of the crossfilter with a range filter on it.
+
+    def __init__(self, crossfilter, column, position):
+        values = crossfilter.df[column].values
+        self.crossfilter = crossfilter
+        self.column = column
+        self.position = position
+        self.order = np.argsort(values, kind='mergesort')
+        self.sorted_values = values[self.order]
+        # the slice of `order` that is currently inside the filter
+        self.bounds = (0, len(values))
+
+    @property
+    def bit(self):
+        # of the type of `filters`, which grows with the number of dimensions
+        bit_type = self.crossfilter.filters.dtype.type
+        return bit_type(1) << bit_type(self.position)
+
+    @property
+    def extent(self):
+        return self.sorted_values[0], self.sorted_values[-1]
+
+    def filter_range(self, lower, upper):
+        lower, upper = sorted([lower, upper])
+        self._filter_slice(np.searchsorted(self.sorted_values, lower, side='left'),
+                           np.searchsorted(self.sorted_values, upper, side='right'))
+
+    def filter_all(self):
+        self._filter_slice(0, len(self.order))
+
+    def _filter_slice(self, start, stop):
+        # only the rows between the old and the new bounds change state
+        old_start, old_stop = self.bounds
+        order = self.order
+        leaving = np.concatenate([order[old_start:min(old_stop, start)],
+                                  order[max(old_start, stop):old_stop]])
+        entering = np.concatenate([order[start:min(stop, old_start)],
+                                   order[max(start, old_stop):stop]])
+        self.bounds = (start, stop)
+        if len(entering) or len(leaving):
+            self.crossfilter._update(self, entering, leaving)
+
+
+class Group(object):
+    # Bins the rows of a dimension and keeps the count (and the sum of `value`,
+    # if given) of the rows in each bin that pass every filter except the one on
+    # the group's own dimension.
+
+    def __init__(self, dimension, bins, value=None):
+        crossfilter = dimension.crossfilter
+        low, high = dimension.extent
+        self.dimension = dimension
+        self.edges = np.linspace(low, high, bins + 1)
+        self.codes = np.clip(
+            np.searchsorted(self.edges, crossfilter.df[dimension.column].values,
+                            side='right') - 1, 0, bins - 1)
+        self.values = crossfilter.df[value].values if value else None
+
+        self.totals = np.bincount(self.codes, minlength=bins)
+        observed = (crossfilter.filters & ~dimension.bit) == 0
+        self.counts = np.bincount(self.codes[observed], minlength=bins)
+        self.sums = None
+        if self.values is not None:
+            self.sums = np.bincount(self.codes[observed],
+                                    weights=self.values[observed], minlength=bins)
+        crossfilter.groups.append(self)
+
+    @property
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+    def add(self, rows):
+        self._reduce(rows, 1)
+
+    def remove(self, rows):
+        self._reduce(rows, -1)
+
+    def clone(self, crossfilter):
+        clone = copy.copy(self)
+        if self.dimension is not None:
+            clone.dimension = crossfilter.dimensions[self.dimension.position]
+        clone.counts = self.counts.copy()
+        if self.sums is not None:
+            clone.sums = self.sums.copy()
+        return clone
+
+    def _reduce(self, rows, sign):
+        if not len(rows):
+            return
+        codes = self.codes[rows]
+        self.counts += sign * np.bincount(codes, minlength=len(self.counts))
+        if self.sums is not None:
+            self.sums += sign * np.bincount(codes, weights=self.values[rows],
+                                            minlength=len(self.sums))
+
+
+class Grid(Group):
+    # Bins the rows of two dimensions into a `width` x `height` grid and counts
+    # the rows in each cell that pass every filter. `counts` is flat, reshape it
+    # to (height, width) to get the grid.
+
+    def __init__(self, x, y, width, height):
+        crossfilter = x.crossfilter
+        (x0, x1), (y0, y1) = x.extent, y.extent
+        self.dimension = None
+        self.shape = (height, width)
+        self.x_edges = np.linspace(x0, x1, width + 1)
+        self.y_edges = np.linspace(y0, y1, height + 1)
+        columns = np.clip(
+            ((crossfilter.df[x.column].values - x0) / ((x1 - x0) or 1) * width)
+            .astype(np.int64), 0, width - 1)
+        rows = np.clip(
+            ((crossfilter.df[y.column].values - y0) / ((y1 - y0) or 1) * height)
+            .astype(np.int64), 0, height - 1)
+        self.codes = rows * width + columns
+        self.values = None
+        self.sums = None
+
+        self.totals = np.bincount(self.codes, minlength=width * height)
+        self.counts = np.bincount(self.codes[crossfilter.passing()],
+                                  minlength=width * height)
+        crossfilter.groups.append(self)
+
+
+def range_shape(x0, x1, y0=0, y1=1, yref='paper'):
+    # a dashed rectangle to highlight the previously selected region
+    return {
+        'type': 'rect',
+        'x0': x0, 'x1': x1, 'y0': y0, 'y1': y1,
+        'yref': yref,
+        'line': {'width': 1, 'dash': 'dot', 'color': 'darkgrey'}
+    }
+
+
+class ScatterView(object):
+    # A scatter plot over two dimensions, box selections filter both of them.
+
+    def __init__(self, id, x_col, y_col):
+        self.id = id
+        self.x_col = x_col
+        self.y_col = y_col
+
+    def bind(self, crossfilter):
+        self.x = crossfilter.dimension(self.x_col).position
+        self.y = crossfilter.dimension(self.y_col).position
+
+    def apply(self, crossfilter, selection):
+        x, y = crossfilter.dimensions[self.x], crossfilter.dimensions[self.y]
+        if selection and selection.get('range'):
+            x.filter_range(*selection['range']['x'])
+            y.filter_range(*selection['range']['y'])
+        else:
+            x.filter_all()
+            y.filter_all()
+
+    def figure(self, crossfilter, selection):
+        x, y = crossfilter.dimensions[self.x], crossfilter.dimensions[self.y]
+        if selection and selection.get('range'):
+            (x0, x1), (y0, y1) = selection['range']['x'], selection['range']['y']
+        else:
+            (x0, x1), (y0, y1) = x.extent, y.extent
+
+        return {
+            'data': [{
+                'x': crossfilter.df[self.x_col],
+                'y': crossfilter.df[self.y_col],
+                'selectedpoints': crossfilter.selected_rows(),
+                'type': 'scattergl',
+                'mode': 'markers',
+                'marker': {'color': 'rgba(0, 116, 217, 0.7)', 'size': 4},
+                'unselected': {'marker': {'opacity': 0.1}}
+            }],
+            'layout': {
+                'margin': {'l': 20, 'r': 0, 'b': 15, 't': 5},
+                'dragmode': 'select',
+                'hovermode': False,
+                'shapes': [range_shape(x0, x1, y0, y1, yref='y')]
+            }
+        }
+
+
+class HistogramView(object):
+    # A histogram of one dimension, drawn from an incrementally updated group.
+    # horizontal box selections filter the dimension.
+
+    def __init__(self, id, col, bins=40):
+        self.id = id
+        self.col = col
+        self.bins = bins
+
+    def bind(self, crossfilter):
+        dimension = crossfilter.dimension(self.col)
+        self.dimension = dimension.position
+        self.group = len(crossfilter.groups)
+        Group(dimension, self.bins)
+
+    def apply(self, crossfilter, selection):
+        dimension = crossfilter.dimensions[self.dimension]
+        if selection and selection.get('range'):
+            dimension.filter_range(*selection['range']['x'])
+        else:
+            dimension.filter_all()
+
+    def figure(self, crossfilter, selection):
+        group = crossfilter.groups[self.group]
+        shapes = []
+        if selection and selection.get('range'):
+            shapes.append(range_shape(*selection['range']['x']))
+
+        return {
+            'data': [{
+                # the unfiltered distribution, drawn behind the filtered one
+                'x': group.centers,
+                'y': group.totals,
+                'type': 'bar',
+                'marker': {'color': 'rgba(0, 0, 0, 0.1)'},
+                'hoverinfo': 'none'
+            }, {
+                'x': group.centers,
+                'y': group.counts,
+                'type': 'bar',
+                'marker': {'color': 'rgba(0, 116, 217, 0.7)'}
+            }],
+            'layout': {
+                'margin': {'l': 40, 'r': 0, 'b': 15, 't': 5},
+                'barmode': 'overlay',
+                'bargap': 0.05,
+                'showlegend': False,
+                'dragmode': 'select',
+                'selectdirection': 'h',
+                'hovermode': False,
+                'shapes': shapes
+            }
+        }
+
+
+class DensityView(ScatterView):
+    # A scatter plot for tables with too many rows to send to the browser.
+    #
+    # the rows are binned into a grid with one cell per pixel of the plot area,
+    # and the grid is drawn as two heatmaps: the selected rows over the rest.
+    # the grid counts are updated incrementally like any other group, so the
+    # cost of an update depends on the number of pixels and of rows that
+    # changed, not on the size of the table.
+
+    def __init__(self, id, x_col, y_col, width=400, height=300):
+        ScatterView.__init__(self, id, x_col, y_col)
+        self.width = width
+        self.height = height
+
+    def bind(self, crossfilter):
+        ScatterView.bind(self, crossfilter)
+        self.grid = len(crossfilter.groups)
+        Grid(crossfilter.dimensions[self.x], crossfilter.dimensions[self.y],
+             self.width, self.height)
+
+    def figure(self, crossfilter, selection):
+        grid = crossfilter.groups[self.grid]
+        selected = grid.counts.reshape(grid.shape)
+        unselected = grid.totals.reshape(grid.shape) - selected
+        x_edges, y_edges = grid.x_edges, grid.y_edges
+        if selection and selection.get('range'):
+            (x0, x1), (y0, y1) = selection['range']['x'], selection['range']['y']
+        else:
+            (x0, x1), (y0, y1) = (x_edges[0], x_edges[-1]), (y_edges[0], y_edges[-1])
+
+        def layer(counts, colorscale):
+            # log scale the counts and leave the empty cells transparent
+            return {
+                'z': np.where(counts > 0, np.round(np.log1p(counts), 2), np.nan),
+                'x0': (x_edges[0] + x_edges[1]) / 2,
+                'dx': x_edges[1] - x_edges[0],
+                'y0': (y_edges[0] + y_edges[1]) / 2,
+                'dy': y_edges[1] - y_edges[0],
+                'type': 'heatmap',
+                'colorscale': colorscale,
+                'showscale': False,
+                'hoverinfo': 'none'
+            }
+
+        margin = {'l': 30, 'r': 0, 'b': 20, 't': 5}
+        return {
+            'data': [
+                layer(unselected, [[0, 'rgb(230, 230, 230)'], [1, 'rgb(130, 130, 130)']]),
+                layer(selected, [[0, 'rgb(160, 200, 240)'], [1, 'rgb(0, 116, 217)']]),
+                # heatmaps can't be selected, so plotly.js only fires selection
+                # events if the graph also has an (invisible) scatter trace
+                {
+                    'x': [x_edges[0], x_edges[-1]],
+                    'y': [y_edges[0], y_edges[-1]],
+                    'type': 'scatter',
+                    'mode': 'markers',
+                    'marker': {'opacity': 0},
+                    'hoverinfo': 'none'
+                }
+            ],
+            'layout': {
+                # one grid cell per pixel of the plot area
+                'width': self.width + margin['l'] + margin['r'],
+                'height': self.height + margin['t'] + margin['b'],
+                'autosize': False,
+                'margin': margin,
+                'xaxis': {'range': [x_edges[0], x_edges[-1]], 'showgrid': False,
+                          'zeroline': False},
+                'yaxis': {'range': [y_edges[0], y_edges[-1]], 'showgrid': False,
+                          'zeroline': False},
+                'showlegend': False,
+                'dragmode': 'select',
+                'hovermode': False,
+                'shapes': [range_shape(x0, x1, y0, y1, yref='y')]
+            }
+        }
+
+
+def crossfilter_layout(views, className='four columns'):
+    session_id = str(uuid.uuid4())
+
+    return html.Div([
+        html.Div(session_id, id='session-id', style={'display': 'none'})
+    ] + [
+        html.Div(
+            dcc.Graph(id=view.id, config={'displayModeBar': False}),
+            className=className
+        ) for view in views
+    ] + [
+        # the geometry of each graph's selection, see assets/selection_geometry.js
+        dcc.Store(id=view.id + '-selection') for view in views
+    ], className='row')
+
+
+def register_crossfilter_callbacks(app, df, views, max_sessions=20):
+    # build the sorted indexes and groups once, each session gets a copy
+    template = Crossfilter(df)
+    for view in views:
+        view.bind(template)
+
+    sessions = collections.OrderedDict()
+    sessions_lock = threading.Lock()
+
+    def get_crossfilter(session_id):
+        with sessions_lock:
+            if session_id in sessions:
+                sessions.move_to_end(session_id)
+            else:
+                sessions[session_id] = template.clone()
+                if len(sessions) > max_sessions:
+                    sessions.popitem(last=False)
+            return sessions[session_id]
+
+    for view in views:
+        app.clientside_callback(
+            ClientsideFunction(namespace='selection', function_name='geometry'),
+            Output(view.id + '-selection', 'data'),
+            [Input(view.id, 'selectedData')]
+        )
+
+    @app.callback(
+        [Output(view.id, 'figure') for view in views],
+        [Input('session-id', 'children')] +
+        [Input(view.id + '-selection', 'data') for view in views]
+    )
+    def update_views(session_id, *selections):
+        crossfilter = get_crossfilter(session_id)
+        with crossfilter.lock:
+            for view, selection in zip(views, selections):
+                view.apply(crossfilter, selection)
+            return [view.figure(crossfilter, selection)
+                    for view, selection in zip(views, selections)]
+
+    return update_views
+
+
+# with a million rows the 2-D views are rendered as density grids, use
+# ScatterView for tables small enough to send every point to the browser
+views = [
+    DensityView('g1', "Col 1", "Col 2"),
+    DensityView('g2', "Col 3", "Col 4"),
+    HistogramView('h1', "Col 5"),
+    HistogramView('h2', "Col 6"),
+    HistogramView('h3', "Col 1"),
+    HistogramView('h4', "Col 3"),
+]
+
+
+def serve_layout():
+    return crossfilter_layout(views, className='four columns')
+
+
+app.layout = serve_layout
+
+register_crossfilter_callbacks(app, df, views)
+
+
+if __name__ == '__main__':
+    app.run_server(debug=True)
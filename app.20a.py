@@ -1,11 +1,23 @@
 # -*- coding: utf-8 -*-
 # -*- coding: utf-8 -*-
+import functools
+import hashlib
+import json
+import logging
+import math
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import numpy as np
 import pandas as pd
-from dash.dependencies import Input, Output
+import plotly
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+from flask_caching import Cache
+
+from cache_backends import (
+    decode_arrow_frame, encode_arrow_frame, store_intermediate)
 
 
 """
@@ -47,9 +59,273 @@ inside a hidden div in the app.
 
 # Example 1 - Storing Data in the Browser with a Hidden Div
 
+"""
+Payload Budgets
+
+Nothing stops a callback from returning a 50MB figure or table, and every byte of
+it is serialized and sent to the browser (and, for the hidden div, sent back again
+as the input of every dependent callback).
+
+The `payload_budget` decorator below estimates the JSON size of a callback's
+response and, when it is over budget, logs the callback name together with a short
+summary of its inputs and applies one of these policies:
+
+    - 'warn'       - log and return the response unchanged
+    - 'downsample' - keep every n-th point of each figure trace so the figure
+                     roughly fits the budget
+    - 'paginate'   - keep only the first page of a list of children
+    - 'reject'     - log and raise PreventUpdate, so nothing is sent
+
+PAYLOAD_BUDGET is the global budget. Pass max_bytes to override it per callback.
+Place the decorator below @app.callback so that it wraps the callback itself.
+
+Dash serializes the response anyway once the callback returns, so the decorator
+doesn't serialize it a second time: the size of a long trace array or list of
+children is extrapolated from its first SAMPLE_ITEMS items.
+"""
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_BUDGET = 2 * 1024 * 1024  # bytes
+SAMPLE_ITEMS = 100
+
+TRACE_ARRAY_KEYS = ('x', 'y', 'z', 'text', 'customdata', 'hovertext', 'ids')
+
+
+def payload_size(value):
+    return len(json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def sampled_size(values):
+    # the JSON size of a long array, estimated from its first items
+    if len(values) <= SAMPLE_ITEMS:
+        return payload_size(values)
+    return int(payload_size(values[:SAMPLE_ITEMS]) * float(len(values)) / SAMPLE_ITEMS)
+
+
+def is_array(value):
+    return hasattr(value, '__len__') and not isinstance(value, (str, dict))
+
+
+def is_figure(value):
+    return hasattr(value, 'to_plotly_json') or (
+        isinstance(value, dict) and 'data' in value)
+
+
+def figure_dict(figure):
+    # a go.Figure as a dictionary, with its trace arrays as given (recent
+    # versions of plotly encode them as base64 strings in to_plotly_json)
+    if isinstance(figure, dict):
+        return figure
+    fig = figure.to_plotly_json()
+    fig['data'] = [
+        dict(trace_json, **{key: getattr(trace, key) for key in TRACE_ARRAY_KEYS
+                            if getattr(trace, key, None) is not None})
+        for trace_json, trace in zip(fig['data'], figure.data)
+    ]
+    return fig
+
+
+def figure_sizes(figure):
+    # (bytes of the trace arrays, bytes of everything else)
+    array_bytes = 0
+    rest = dict(figure)
+    rest['data'] = []
+    for trace in figure.get('data', []):
+        arrays = [key for key in TRACE_ARRAY_KEYS if is_array(trace.get(key))]
+        array_bytes += sum(sampled_size(trace[key]) for key in arrays)
+        rest['data'].append(
+            {key: value for key, value in trace.items() if key not in arrays})
+    return array_bytes, payload_size(rest)
+
+
+def response_size(response):
+    if is_figure(response):
+        return sum(figure_sizes(figure_dict(response)))
+    if isinstance(response, (list, tuple)):
+        return sampled_size(response)
+    return payload_size(response)
+
+
+def summarize_inputs(args, width=40):
+    summary = []
+    for arg in args:
+        text = repr(arg)
+        if len(text) > width:
+            text = '{}... ({} chars)'.format(text[:width], len(text))
+        summary.append(text)
+    return ', '.join(summary)
+
+
+def downsample_figure(figure, budget):
+    # only the trace arrays shrink, so the factor is what they need to
+    # fit in what the rest of the figure leaves of the budget
+    fig = dict(figure_dict(figure))
+    array_bytes, other_bytes = figure_sizes(fig)
+    factor = int(math.ceil(float(array_bytes) / max(budget - other_bytes, 1)))
+    fig['data'] = [
+        {key: (value[::factor] if key in TRACE_ARRAY_KEYS and is_array(value) else value)
+         for key, value in trace.items()}
+        for trace in fig.get('data', [])
+    ]
+    return fig
+
+
+def paginate_children(value, factor):
+    if isinstance(value, (list, tuple)):
+        return value[:max(1, len(value) // factor)]
+    if isinstance(getattr(value, 'children', None), (list, tuple)):
+        value.children = paginate_children(value.children, factor)
+    return value
+
+
+def payload_budget(policy='warn', max_bytes=None):
+    def decorator(callback):
+        @functools.wraps(callback)
+        def wrapper(*args):
+            response = callback(*args)
+            budget = max_bytes or PAYLOAD_BUDGET
+            size = response_size(response)
+            if size <= budget:
+                return response
+
+            logger.warning(
+                'Callback %s returned about %d bytes (budget %d, policy %r) for inputs: %s',
+                callback.__name__, size, budget, policy, summarize_inputs(args))
+            if policy == 'downsample' and is_figure(response):
+                return downsample_figure(response, budget)
+            if policy == 'paginate':
+                return paginate_children(response, int(math.ceil(float(size) / budget)))
+            if policy == 'reject':
+                raise PreventUpdate
+            return response
+        return wrapper
+    return decorator
+
+
+"""
+Arrow IPC Transport
+
+Serializing the intermediate dataframe to JSON loses its column types (dates come
+back as strings unless they are parsed again) and both to_json and read_json are
+slow for large frames. Instead, the frame can be written in the Apache Arrow IPC
+format, compressed with zstd, and base64-encoded so it can be stored in the
+browser like any other string (encode_arrow_frame and decode_arrow_frame, see
+cache_backends.py). Every column keeps its type and decoding it is mostly a copy
+of the column buffers.
+
+Be sure to pip install the new dependency: pyarrow
+
+See benchmarks/intermediate_transport.py for a comparison of the payload size and
+the encode / decode time of both transports.
+"""
+
+"""
+Keeping the Intermediate Data on the Server
+
+Even compressed, the intermediate data travels to the browser and back again with
+every dependent callback. Instead, clean_data can write it to a store shared by
+every process (the filesystem cache here, or Redis) under a key, and the hidden
+div only carries that key and the dropdown value it was computed
+from. The consumers read the frame from the store, so each dependent callback
+moves a few bytes over the network instead of the whole dataset.
+
+Entries expire after INTERMEDIATE_TTL seconds. If a consumer finds that its entry
+has expired (or was evicted), it computes the data again from the dropdown value,
+under the key of the current data.
+
+Be sure to pip install the new dependency: flask_caching
+"""
+
+INTERMEDIATE_TTL = 60 * 60  # seconds
+
+
+"""
+Sharing Computations Between Sessions
+
+your_expensive_clean_or_compute_step(value) only depends on the dropdown value and
+on global_df, so when many users select the same value they can all share a single
+result. The key of a result is derived from the identity of the function, its
+normalized arguments and a hash of the data it reads (DATA_VERSION). A session in
+any process asking for the same computation finds the result already in the store
+and doesn't compute it again, and a new version of the data gets new keys.
+
+Results are reference counted: clean_data acquires a reference to the result for
+the newly selected value and releases the one it held before. A result that no
+session references anymore is deleted. The counts and the results also expire
+after INTERMEDIATE_TTL, so references leaked by closed browser tabs can't keep a
+result alive forever.
+
+Note that the filesystem cache increments and decrements the counts with a read
+followed by a write. Use Redis, whose INCR and DECR are atomic, when several
+processes share the store.
+"""
+
+
+def frame_version(df):
+    return hashlib.sha1(pd.util.hash_pandas_object(df).values).hexdigest()
+
+
+def computation_key(function, args):
+    normalized = json.dumps(args, sort_keys=True, default=repr)
+    identity = '{}.{}({})@{}'.format(
+        function.__module__, function.__name__, normalized, DATA_VERSION)
+    return 'computation-' + hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+def acquire_computation(function, *args):
+    # take a reference to the result of function(*args), computing it
+    # only if no session has done it already. (inc, dec and has are
+    # methods of the cache backend, `cache.cache`)
+    key = computation_key(function, args)
+    cache.cache.inc(key + '-references')
+    acquired = False
+    try:
+        if not cache.cache.has(key):
+            store_intermediate(cache, encode_arrow_frame(function(*args)),
+                               timeout=INTERMEDIATE_TTL, key=key)
+        acquired = True
+    finally:
+        # if the computation failed, no session holds the reference
+        # that was just taken, so nothing would ever release it
+        if not acquired:
+            release_computation(key)
+    return key
+
+
+def release_computation(key):
+    if (cache.cache.dec(key + '-references') or 0) <= 0:
+        cache.delete_many(key, key + '-references')
+
+
+def load_cleaned_data(signal):
+    signal = json.loads(signal)
+    payload = cache.get(signal['key'])
+    if payload is None:
+        # the data may have changed since the signal was sent, so the result
+        # is looked up (and computed again) under the key of the current data
+        key = computation_key(your_expensive_clean_or_compute_step,
+                              (signal['value'],))
+        payload = cache.get(key)
+        if payload is None:
+            payload = encode_arrow_frame(
+                your_expensive_clean_or_compute_step(signal['value']))
+            store_intermediate(cache, payload, timeout=INTERMEDIATE_TTL, key=key)
+    return decode_arrow_frame(payload)
+
+
 global_df = pd.read_csv('data.csv')
+DATA_VERSION = frame_version(global_df)
 
 app = dash.Dash(__name__)
+cache = Cache(app.server, config={
+    # the store has to be shared by every process of the app.
+    # try 'redis' (with CACHE_REDIS_URL) if you run on several machines.
+    'CACHE_TYPE': 'filesystem',
+    'CACHE_DIR': 'cache-directory',
+    'CACHE_THRESHOLD': 200,
+    'CACHE_DEFAULT_TIMEOUT': INTERMEDIATE_TTL
+})
 
 app.layout = html.Div([
     dcc.Graph(id='graph'),
@@ -60,27 +336,36 @@ app.layout = html.Div([
     html.Div(id='intermediate-value', style={'display': 'none'})
 ])
 
-@app.callback(Output('intermediate-value', 'children'), [Input('dropdown', 'value')])
-def clean_data(value):
-     # some expensive clean data step
-     cleaned_df = your_expensive_clean_or_compute_step(value)
+@app.callback(Output('intermediate-value', 'children'),
+              [Input('dropdown', 'value')],
+              [State('intermediate-value', 'children')])
+@payload_budget(policy='warn')
+def clean_data(value, previous_signal):
+     # some expensive clean data step, shared by every session that selects
+     # the same value. the result is stored with encode_arrow_frame, the JSON
+     # version of which would be cleaned_df.to_json(date_format='iso', orient='split')
+     key = acquire_computation(your_expensive_clean_or_compute_step, value)
+     if previous_signal:
+         release_computation(json.loads(previous_signal)['key'])
 
-     # more generally, this line would be
-     # json.dumps(cleaned_df)
-     return cleaned_df.to_json(date_format='iso', orient='split')
+     # only the key (and the value needed to compute the data again)
+     # is sent to the browser
+     return json.dumps({'key': key, 'value': value})
 
 @app.callback(Output('graph', 'figure'), [Input('intermediate-value', 'children')])
-def update_graph(jsonified_cleaned_data):
+@payload_budget(policy='downsample')
+def update_graph(signal):
 
-    # more generally, this line would be
-    # json.loads(jsonified_cleaned_data)
-    dff = pd.read_json(jsonified_cleaned_data, orient='split')
+    # the JSON version of this line would be
+    # pd.read_json(jsonified_cleaned_data, orient='split')
+    dff = load_cleaned_data(signal)
 
     figure = create_figure(dff)
     return figure
 
 @app.callback(Output('table', 'children'), [Input('intermediate-value', 'children')])
-def update_table(jsonified_cleaned_data):
-    dff = pd.read_json(jsonified_cleaned_data, orient='split')
+@payload_budget(policy='paginate', max_bytes=512 * 1024)
+def update_table(signal):
+    dff = load_cleaned_data(signal)
     table = create_table(dff)
     return table
@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
 # -*- coding: utf-8 -*-
+import io
+import json
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import numpy as np
 import pandas as pd
 from dash.dependencies import Input, Output
+from flask_caching import Cache
+
+from cache_backends import store_intermediate
 
 """
 Example 2 - Computing Aggregations Upfront
@@ -20,11 +26,40 @@ Here's a simple example of how you might transport filtered or aggregated data t
  multiple callbacks.
 """
 
+"""
+As in Example 1, the aggregations don't have to travel to the browser at all:
+clean_data writes them to a store shared by every process under the hash of their
+content, and the hidden div only carries that key and the dropdown value they were
+computed from. Entries expire after INTERMEDIATE_TTL seconds, and a consumer that
+finds its entry gone computes the aggregations again and stores them under the
+hash of their new content (see store_intermediate in cache_backends.py).
+
+Each aggregation (or "slice") is serialized and stored on its own, under its own
+key. A consumer reads and decodes only the slice it displays instead of the whole
+bundle, so its cost is proportional to the size of that slice alone.
+"""
+
 # Example 2 - Computing Aggregations Upfront
 
+INTERMEDIATE_TTL = 60 * 60  # seconds
+
+# the slices computed by `compute_datasets`, and the fruit each one holds
+SLICES = {
+    'df_1': 'apples',
+    'df_2': 'oranges',
+    'df_3': 'figs',
+}
+
 global_df = pd.read_csv('data.csv')
 
 app = dash.Dash(__name__)
+cache = Cache(app.server, config={
+    # the store has to be shared by every process of the app.
+    # try 'redis' (with CACHE_REDIS_URL) if you run on several machines.
+    'CACHE_TYPE': 'filesystem',
+    'CACHE_DIR': 'cache-directory',
+    'CACHE_THRESHOLD': 200
+})
 
 app.layout = html.Div([
     dcc.Graph(id='graph'),
@@ -35,50 +70,74 @@ app.layout = html.Div([
     html.Div(id='intermediate-value', style={'display': 'none'})
 ])
 
-@app.callback(
-    Output('intermediate-value', 'children'),
-    [Input('dropdown', 'value')])
-def clean_data(value):
+def compute_datasets(value):
      # an expensive query step
      cleaned_df = your_expensive_clean_or_compute_step(value)
 
      # a few filter steps that compute the data
-     # as it's needed in the future callbacks
-     df_1 = cleaned_df[cleaned_df['fruit'] == 'apples']
-     df_2 = cleaned_df[cleaned_df['fruit'] == 'oranges']
-     df_3 = cleaned_df[cleaned_df['fruit'] == 'figs']
-
-     datasets = {
-         'df_1': df_1.to_json(orient='split', date_format='iso'),
-         'df_2': df_2.to_json(orient='split', date_format='iso'),
-         'df_3': df_3.to_json(orient='split', date_format='iso'),
+     # as it's needed in the future callbacks.
+     # split the frame once by fruit rather than filtering it once per fruit,
+     # and serialize every slice on its own
+     by_fruit = dict(list(cleaned_df.groupby('fruit', sort=False)))
+     empty_df = cleaned_df.iloc[:0]
+
+     return {
+         name: by_fruit.get(fruit, empty_df).to_json(orient='split', date_format='iso')
+         for name, fruit in SLICES.items()
      }
 
-     return json.dumps(datasets)
+
+def store_slices(datasets):
+    # every slice under the hash of its content
+    return {
+        name: store_intermediate(cache, payload, timeout=INTERMEDIATE_TTL)
+        for name, payload in datasets.items()
+    }
+
+
+def load_slice(signal, name):
+    # read and decode only the slice `name`
+    signal = json.loads(signal)
+    payload = cache.get(signal['slices'][name])
+    if payload is None:
+        # the data may have changed since the signal was sent, so the slices
+        # computed again go under the keys of their new content
+        datasets = compute_datasets(signal['value'])
+        store_slices(datasets)
+        payload = datasets[name]
+    return pd.read_json(io.StringIO(payload), orient='split')
+
+
+@app.callback(
+    Output('intermediate-value', 'children'),
+    [Input('dropdown', 'value')])
+def clean_data(value):
+     slices = store_slices(compute_datasets(value))
+
+     # only the keys of the slices (and the value needed to compute
+     # them again) are sent to the browser
+     return json.dumps({'slices': slices, 'value': value})
 
 @app.callback(
     Output('graph', 'figure'),
     [Input('intermediate-value', 'children')])
-def update_graph_1(jsonified_cleaned_data):
-    datasets = json.loads(jsonified_cleaned_data)
-    dff = pd.read_json(datasets['df_1'], orient='split')
+def update_graph_1(signal):
+    dff = load_slice(signal, 'df_1')
     figure = create_figure_1(dff)
     return figure
 
 @app.callback(
     Output('graph', 'figure'),
     [Input('intermediate-value', 'children')])
-def update_graph_2(jsonified_cleaned_data):
-    datasets = json.loads(jsonified_cleaned_data)
-    dff = pd.read_json(datasets['df_2'], orient='split')
+def update_graph_2(signal):
+    dff = load_slice(signal, 'df_2')
     figure = create_figure_2(dff)
     return figure
 
 @app.callback(
     Output('graph', 'figure'),
     [Input('intermediate-value', 'children')])
-def update_graph_3(jsonified_cleaned_data):
-    datasets = json.loads(jsonified_cleaned_data)
-    dff = pd.read_json(datasets['df_3'], orient='split')
+def update_graph_3(signal):
+    dff = load_slice(signal, 'df_3')
     figure = create_figure_3(dff)
     return figure
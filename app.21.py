@@ -40,6 +40,116 @@ Here’s what this example looks like. Some things to note:
     - Similarly, reloading the page or opening the app in a new window is also
       fast because the initial state and the initial expensive computation has
       already been computed.
+
+Single-Flight Computations
+
+The signal only protects the first computation of a session. On a cold cache,
+several sessions (or a session's callbacks, if the signal is bypassed) can still
+call global_store with the same value at the same time, and every one of them
+would run the expensive computation in its own process.
+
+The single_flight decorator below prevents this: the first caller takes a lock
+shared by every process and computes the value, the others wait for the value to
+appear in the cache and read it from there. The lock is a `SET NX` in Redis, or a
+file created with O_EXCL when the cache is on the filesystem (which only works for
+the processes of a single machine). A lock older than `lock_timeout` is assumed to
+have been left behind by a crashed process and is broken (by renaming it, so that
+only one of the waiting processes breaks it). Each lock holds a random token of
+its owner, and is only released if it still holds that token, so a holder that
+ran past `lock_timeout` doesn't release the lock another process took since.
+
+The number of calls, cache hits, computations, callers that had to wait for
+another process, and the total time they waited are counted in the cache (with
+the filesystem cache, increments from different processes can occasionally be
+lost). They can be read at /metrics/single-flight.
+
+Near Cache
+
+Even a cache hit goes over the network to Redis (or to the disk) and unpickles the
+whole dataframe. near_cache keeps the most recently used values in the memory of
+each process as well, so a warm hit is a dictionary lookup. Version stamps in the
+shared cache tell it when a value has changed, and `global_store.invalidate(value)`
+broadcasts the removal of a value to every process over Redis pub/sub (or a log
+file, with the filesystem cache). See Near Cache in cache_backends.py.
+
+The local copies only help in processes that serve many requests: gunicorn
+workers, or the dev server with processes=1, threaded=True. With processes=6,
+the dev server forks a new process for every request, which starts with an empty
+near cache (and its own listener) and exits after the response, so every call
+reads the shared cache as if there was no near cache.
+
+Warm-Up
+
+global_store is only ever called with the categories of the dropdown, so there's
+no reason for the first user who selects each of them to wait for the
+computation. Decorate a memoized function with `@warm_up(domain)` to list the
+arguments it should be computed for ahead of time (pass a function to read the
+domain when the warm-up runs rather than when the module is imported).
+start_warm_up computes every registered value in a background thread when the
+app starts (when the dev server starts, or with the first request of each
+gunicorn worker), at most WARM_UP_WORKERS at a time so that the requests still
+get a share of the CPU. Since the functions are single-flight, the other
+processes starting at the same time read the values instead of computing them
+again. Importing this module doesn't start anything.
+
+/health/ready answers 503 until the warm-up of its process has finished, so a
+load balancer can hold back traffic from a new deploy until the cache is warm.
+POST to /warm-up to run the warm-up again, e.g. after invalidating the cache:
+the request is recorded in the cache, and the thread of every process that runs
+the warm-up picks it up within WARM_UP_POLL_INTERVAL seconds (the dev server
+handles each request in a process forked for it and gone after the response).
+
+Shared Memory
+
+If the processes all run on one machine, they don't need Redis to share the
+values: with the `cache_backends.SharedMemoryCache` CACHE_TYPE, the values are
+stored in shared memory (see cache_backends.py). Unlike the filesystem cache,
+which pickles the whole dataframe, the numeric columns of global_store's
+dataframes are stored as raw buffers that every process maps without copying
+them. The locks and the invalidation bus work as with the filesystem cache.
+Unlike with the other backends, cache.get returns bytes values as a memoryview of
+the mapped entry (decode_frame takes either). The frames it returns can be
+modified, copy-on-write, without changing the cached entry.
+
+Zero-Copy Values
+
+With the other backends, every cache hit unpickles the dataframe, copying each of
+its columns. global_store returns its dataframe encoded with encode_frame instead
+(see cache_backends.py) and near_cache decodes it with decode_frame, which wraps
+the column buffers of the cached bytes rather than copying them.
+
+Compression
+
+Stored as they are, the few large dataframes take most of Redis' memory. The
+CompressedRedisCache backend compresses every value worth compressing, picking
+zstd for the large ones and lz4 for the others (see cache_backends.py), so Redis
+holds and sends a fraction of the raw size. /metrics/compression shows the
+compression ratio and the time spent compressing and decompressing in the
+process that answers.
+
+Sharding
+
+A single Redis can only hold and serve so much. List several nodes in REDIS_URLS
+and the ShardedRedisCache backend spreads the keys over them with consistent
+hashing, so adding a node only moves the keys it takes over (see
+cache_backends.py and benchmarks/sharded_cache.py). A lock lives on the node of
+its key like any other value, and the invalidation bus uses the first node.
+
+Data Versions
+
+@cache.memoize() keys the values on the arguments only, so when the data behind
+global_store changes, the old values keep being served (or the whole cache has to
+be cleared). Register the data with `set_dataset(name, df)` and memoize with
+`@memoize(name)` instead: the content hash of each dataset the function depends
+on is part of its keys and of its version stamps. Calling set_dataset with new
+data changes the keys of exactly the functions that depend on it, while the
+values of the other functions stay cached. Every process that loads the same
+data computes the same hash, so they keep sharing their values; the values of
+the old data are never read again and expire or are evicted.
+
+memoize also hashes the arguments by content (see argument_hash in
+cache_backends.py) rather than with their str(), so a function can be memoized
+on dataframes, arrays and dictionaries, not only on scalar ids.
 """
 
 # Example 3 - Caching and Signaling
@@ -50,9 +160,15 @@ Here’s what this example looks like. Some things to note:
 #    $ brew services start redis
 
 import os
+import concurrent.futures
 import copy
+import errno
+import functools
+import tempfile
+import threading
 import time
 import datetime
+import uuid
 
 import dash
 import dash_core_components as dcc
@@ -60,7 +176,13 @@ import dash_html_components as html
 import numpy as np
 import pandas as pd
 from dash.dependencies import Input, Output
+import flask
+import redis
+from cache_backends import (InvalidationBus, NearCache, ShardedRedisCache,
+                            argument_hash, compression_report, encode_frame,
+                            decode_frame)
 from flask_caching import Cache
+from flask_caching.backends.rediscache import RedisCache
 
 
 external_stylesheets = [
@@ -70,14 +192,331 @@ external_stylesheets = [
     'https://codepen.io/chriddyp/pen/brPBPO.css']
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+# comma separated, to shard the cache over several redis nodes
+REDIS_URLS = os.environ.get(
+    'REDIS_URLS', os.environ.get('REDIS_URL', 'redis://localhost:6379')).split(',')
 CACHE_CONFIG = {
-    # try 'filesystem' if you don't want to setup redis
-    'CACHE_TYPE': 'redis',
-    'CACHE_REDIS_URL': os.environ.get('REDIS_URL', 'redis://localhost:6379')
+    # redis, sharded over REDIS_URLS, with the values compressed (see
+    # cache_backends.py). try 'cache_backends.CompressedFileSystemCache' if you
+    # don't want to setup redis, or 'cache_backends.SharedMemoryCache' to share
+    # the values between the processes of this machine through shared memory
+    'CACHE_TYPE': 'cache_backends.ShardedRedisCache',
+    'CACHE_REDIS_URLS': REDIS_URLS
 }
 cache = Cache()
 cache.init_app(app.server, config=CACHE_CONFIG)
 
+LOCK_DIR = os.path.join(tempfile.gettempdir(), 'dash-single-flight-locks')
+SINGLE_FLIGHT_METRICS = ['calls', 'hits', 'computations', 'waits', 'wait_ms']
+
+INVALIDATION_LOG = os.path.join(LOCK_DIR, 'invalidations.log')
+
+
+def uses_redis():
+    return isinstance(cache.cache, (RedisCache, ShardedRedisCache))
+
+
+# the local copies of the values, see Near Cache in cache_backends.py
+near_cache = NearCache(cache, InvalidationBus(
+    REDIS_URLS[0] if uses_redis() else None, log_path=INVALIDATION_LOG))
+
+
+def make_lock_dir():
+    try:
+        os.makedirs(LOCK_DIR)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def redis_lock(lock_key):
+    # the client of the redis node that holds the lock, and the key there
+    node = cache.cache
+    if isinstance(node, ShardedRedisCache):
+        node = node.shard(lock_key)
+    return node._write_client, node._get_prefix() + lock_key
+
+
+def acquire_lock(lock_key, token, lock_timeout):
+    # take the lock with the random `token`, which only its owner knows
+    if uses_redis():
+        # SET NX: only one process can create the key
+        client, key = redis_lock(lock_key)
+        return bool(client.set(key, token, nx=True, ex=lock_timeout))
+
+    # O_EXCL: only one process can create the file
+    path = os.path.join(LOCK_DIR, lock_key)
+    make_lock_dir()
+    try:
+        lock = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    else:
+        try:
+            os.write(lock, token.encode('ascii'))
+        finally:
+            os.close(lock)
+        return True
+    try:
+        if time.time() - os.path.getmtime(path) <= lock_timeout:
+            return False
+        # move the stale lock away under a unique name rather than removing
+        # it: of the processes that found it stale, only one can rename it
+        stale = '{}.stale-{}'.format(path, uuid.uuid4().hex)
+        os.rename(path, stale)
+    except OSError:
+        return False
+    try:
+        if time.time() - os.path.getmtime(stale) <= lock_timeout:
+            # it was released and taken again in between, put it back
+            os.link(stale, path)
+            return False
+    except OSError:
+        return False
+    finally:
+        os.remove(stale)
+    return acquire_lock(lock_key, token, lock_timeout)
+
+
+def release_lock(lock_key, token):
+    # only if the lock is still ours: after `lock_timeout`, it may have
+    # been broken and taken by another process
+    if uses_redis():
+        client, key = redis_lock(lock_key)
+        with client.pipeline() as pipe:
+            try:
+                # compare and delete: the DEL fails if the key changes
+                # after the GET
+                pipe.watch(key)
+                if pipe.get(key) == token.encode('ascii'):
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.execute()
+            except redis.WatchError:
+                pass
+        return
+
+    # moved away before it's read, like a stale lock, so that it can't be
+    # broken and taken between reading and removing it
+    path = os.path.join(LOCK_DIR, lock_key)
+    released = '{}.released-{}'.format(path, uuid.uuid4().hex)
+    try:
+        os.rename(path, released)
+    except OSError:
+        return
+    try:
+        with open(released) as f:
+            if f.read() != token:
+                # another process's lock, put it back
+                os.link(released, path)
+    except OSError:
+        pass
+    finally:
+        os.remove(released)
+
+
+def count(name, metric, amount=1):
+    cache.cache.inc('single-flight-{}-{}'.format(name, metric), int(amount))
+
+
+def count_read(name, waited, started):
+    # a value read from the cache rather than computed
+    if waited:
+        count(name, 'waits')
+        count(name, 'wait_ms', 1000 * (time.time() - started))
+    else:
+        count(name, 'hits')
+
+
+def single_flight(lock_timeout=60, poll_interval=0.05):
+    # Place the decorator above @memoize()
+    def decorator(memoized):
+        name = memoized.__name__
+
+        @functools.wraps(memoized)
+        def wrapper(*args, **kwargs):
+            count(name, 'calls')
+            # keyed like the version stamps: on the data version and the
+            # arguments, but not on the memoize version of the function, which
+            # concurrent callers each create on a cold cache
+            lock_key = 'lock-' + memoized.stamp_key(args, kwargs).replace('/', '_')
+            token = uuid.uuid4().hex
+            started = time.time()
+            waited = False
+            while True:
+                # looked up again every time, once the memoize version is
+                # settled the value is stored under this key
+                cache_key = memoized.make_cache_key(memoized.uncached, *args, **kwargs)
+                value = cache.get(cache_key)
+                if value is not None:
+                    count_read(name, waited, started)
+                    return value
+
+                if acquire_lock(lock_key, token, lock_timeout):
+                    try:
+                        # the previous holder may have stored the value
+                        # since it was looked up
+                        value = cache.get(cache_key)
+                        if value is not None:
+                            count_read(name, waited, started)
+                            return value
+                        count(name, 'computations')
+                        return memoized(*args, **kwargs)
+                    finally:
+                        release_lock(lock_key, token)
+
+                # another process is computing the value, wait for it
+                waited = True
+                time.sleep(poll_interval)
+        return wrapper
+    return decorator
+
+
+# name -> (dataframe, content hash)
+datasets = {}
+# function name -> names of the datasets it depends on
+dependencies = {}
+
+
+def frame_version(df):
+    return argument_hash(df)
+
+
+def set_dataset(name, df):
+    datasets[name] = (df, frame_version(df))
+
+
+def dataset(name):
+    return datasets[name][0]
+
+
+def data_version(function_name):
+    return ','.join('{}={}'.format(name, datasets[name][1])
+                    for name in dependencies.get(function_name, ()))
+
+
+def memoize(*names, **kwargs):
+    # near_cache.memoize, with the current versions of the datasets `names`
+    # folded into the keys and the version stamps
+    def decorator(function):
+        dependencies[function.__name__] = names
+        return near_cache.memoize(make_name=lambda fname: '{}@{}'.format(
+            fname, data_version(function.__name__)), **kwargs)(function)
+    return decorator
+
+
+@app.server.route('/metrics/single-flight')
+def single_flight_metrics():
+    return flask.jsonify({
+        name: {
+            metric: cache.get('single-flight-{}-{}'.format(name, metric)) or 0
+            for metric in SINGLE_FLIGHT_METRICS
+        } for name in ['global_store']
+    })
+
+@app.server.route('/metrics/compression')
+def compression_metrics():
+    return flask.jsonify(compression_report())
+
+
+WARM_UP_WORKERS = 2
+WARM_UP_POLL_INTERVAL = 1  # seconds, between checks for a new warm-up request
+WARM_UP_REQUEST_KEY = 'warm-up-requested'
+# the functions to warm up with their argument domains
+warm_up_functions = []
+warm_up_status = {'state': 'pending', 'total': 0, 'done': 0, 'failed': 0}
+warm_up_runner = {'pid': None, 'lock': threading.Lock()}
+
+
+def warm_up(domain):
+    # register the decorated function to be computed for every value
+    # in `domain` (or in `domain()`) when the warm-up runs.
+    # place the decorator above the caching decorators
+    def decorator(function):
+        warm_up_functions.append((function, domain))
+        return function
+    return decorator
+
+
+def run_warm_up(max_workers=WARM_UP_WORKERS):
+    calls = [
+        (function, value)
+        for function, domain in warm_up_functions
+        for value in (domain() if callable(domain) else domain)
+    ]
+    warm_up_status.update(state='running', total=len(calls), done=0, failed=0)
+
+    def call(function, value):
+        with app.server.app_context():
+            function(value)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = [executor.submit(call, function, value)
+                   for function, value in calls]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+                warm_up_status['done'] += 1
+            except Exception:
+                app.server.logger.exception('Warm-up call failed')
+                warm_up_status['failed'] += 1
+    warm_up_status['state'] = 'ready'
+
+
+def warm_up_loop(max_workers):
+    # run the warm-up now, and again every time it's requested
+    # (by any process, see rerun_warm_up)
+    seen = None
+    while True:
+        try:
+            requested = cache.get(WARM_UP_REQUEST_KEY)
+            if warm_up_status['state'] == 'pending' or requested != seen:
+                seen = requested
+                run_warm_up(max_workers)
+        except Exception:
+            app.server.logger.exception('Warm-up failed')
+        time.sleep(WARM_UP_POLL_INTERVAL)
+
+
+def start_warm_up(max_workers=WARM_UP_WORKERS):
+    # once, in a process that stays up: the process of the dev server, or
+    # each worker of gunicorn. a process forked from one that had already
+    # started it (like the dev server's process for each request) doesn't
+    # start it again, it would be killed after the response
+    with warm_up_runner['lock']:
+        if warm_up_runner['pid'] is not None:
+            return False
+        warm_up_runner['pid'] = os.getpid()
+    thread = threading.Thread(target=warm_up_loop, args=(max_workers,))
+    thread.daemon = True
+    thread.start()
+    return True
+
+
+@app.server.before_request
+def start_warm_up_with_worker():
+    # when the app is served by gunicorn, which doesn't run __main__
+    start_warm_up()
+
+
+@app.server.route('/health/ready')
+def ready():
+    status = 200 if warm_up_status['state'] == 'ready' else 503
+    return flask.jsonify(warm_up_status), status
+
+
+@app.server.route('/warm-up', methods=['POST'])
+def rerun_warm_up():
+    # the request may be handled in a process forked for it, so the
+    # warm-up is requested through the cache from the processes that
+    # run it, rather than started here
+    if warm_up_status['state'] == 'running':
+        return flask.jsonify(warm_up_status), 409
+    cache.set(WARM_UP_REQUEST_KEY, uuid.uuid4().hex, timeout=0)
+    return flask.jsonify(warm_up_status), 202
+
+
 N = 100
 
 df = pd.DataFrame({
@@ -88,8 +527,11 @@ df = pd.DataFrame({
         (['pineapples'] * 15 * N)
     )
 })
+# the same random data in every process, so that they share the cache
+np.random.seed(0)
 df['x'] = np.random.randn(len(df['category']))
 df['y'] = np.random.randn(len(df['category']))
+set_dataset('fruits', df)
 
 app.layout = html.Div([
     dcc.Dropdown(
@@ -115,12 +557,22 @@ app.layout = html.Div([
 # these computations are cached in a globally available
 # redis memory store which is available across processes
 # and for all time.
-@cache.memoize()
+# single_flight makes sure that only one process runs the
+# computation for a given value while the others wait for it,
+# and near_cache keeps the latest values in this process too.
+# warm_up computes the value of every category when the app starts.
+# the values are keyed on the version of the fruits dataset too, call
+# set_dataset('fruits', new_df) to refresh it.
+@warm_up(lambda: dataset('fruits')['category'].unique())
+@near_cache(decode=decode_frame)
+@single_flight()
+@memoize('fruits')
 def global_store(value):
     # simulate expensive query
     print('Computing value with {}'.format(value))
     time.sleep(5)
-    return df[df['category'] == value]
+    fruits = dataset('fruits')
+    return encode_frame(fruits[fruits['category'] == value])
 
 
 def generate_figure(value, figure):
@@ -190,5 +642,9 @@ def update_graph_4(value):
 
 
 if __name__ == '__main__':
+    # in debug mode, the reloader runs this file in a parent process that
+    # only watches the files, and again in the process that serves the app
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warm_up()
     app.run_server(debug=True, processes=6, threaded=False)   # Needed the threaded=False to avoid "ValueError: cannot have a multithreaded and multi process server."
-    # app.run_server(debug=True, processes=1, threaded=True)    # This would also work.
+    # app.run_server(debug=True, processes=1, threaded=True)    # This would also work, and keeps the near cache between requests.
@@ -25,8 +25,11 @@ This example:
 
     - Caches data using the flask_caching filesystem cache. You can also save
       to an in-memory database like Redis.
-    - Serializes the data as JSON.
-        -- If you are using Pandas, consider serializing with Apache Arrow.
+    - Serializes the data with encode_frame (from cache_backends.py), which
+      stores the columns as raw buffers that a cache hit wraps without parsing
+      or copying them.
+        -- df.to_json() works too, but parsing it again is orders of magnitude
+           slower (see benchmarks/cache_codecs.py).
     - Saves session data up to the number of expected concurrent users.
       This prevents the cache from being overfilled with data.
     - Creates unique session IDs by embedding a hidden random string into the
@@ -46,6 +49,46 @@ There are three things to notice in this example:
       are instant, as the data has been cached.
     - The second session displays different data than the first session: the
       data that is shared between callbacks is isolated to individual user sessions.
+
+Near Cache
+
+Every cache hit still reads the data from the disk (or Redis) and decodes it into
+a dataframe again. As in Part 6B, near_cache keeps the parsed dataframes of the most
+recent sessions in the memory of each process, and version stamps written by
+near_cache.memoize tell it when the shared value has changed. When the janitor
+below deletes the data of a session, the other processes are told to drop their
+copies too. The dataframes kept locally are shared by the callbacks, so treat them
+as read-only.
+
+Session Budgets
+
+CACHE_THRESHOLD counts entries and ignores their size, and the cache can't tell
+the data of a closed browser tab from the data of a live session, so dead sessions
+fill the disk until the threshold evicts entries at random. Instead, a small
+ledger records the size of each session's data and, in the modification time of
+its file, when the session last used it:
+
+    - SESSION_QUOTA - data bigger than this is returned but never stored
+    - SESSION_IDLE_TTL - data that hasn't been used for this long is deleted
+    - SESSION_BYTE_BUDGET - when the sessions hold more than this in total, the
+      least recently used ones are deleted until they fit again
+
+A janitor thread in each process sweeps the ledger every JANITOR_INTERVAL seconds,
+so requests never wait for the cleanup. A lock file makes sure that only one
+process sweeps at a time. The ledger lives on the local disk like the filesystem
+cache; with Redis, keep it in a sorted set instead.
+
+Stale While Revalidate
+
+When the data of a session gets old, recomputing it makes the user sit through the
+whole (five second) query again for data they've already seen. With
+stale_while_revalidate, data older than `soft_ttl` is still returned right away
+and a single background thread computes the new version; the callbacks pick it
+up as soon as it's stored. Only data older than `hard_ttl` is never served, and is
+computed again while the user waits. The version stamps record when each value
+was computed, so the age of a value is known without reading the value itself.
+A refreshed value is stored like any other, so data over SESSION_QUOTA isn't
+stored by a refresh either (and the old data is deleted).
 """
 
 # Example 4 - User-Based Session Data on the Server
@@ -55,9 +98,18 @@ from dash.dependencies import Input, Output
 import dash_core_components as dcc
 import dash_html_components as html
 import datetime
+import errno
+import fcntl
+import functools
+import hashlib
+from cache_backends import (InvalidationBus, NearCache, encode_frame,
+                            decode_frame)
 from flask_caching import Cache
+import json
+import logging
 import os
 import pandas as pd
+import threading
 import time
 import uuid
 
@@ -69,42 +121,228 @@ external_stylesheets = [
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 cache = Cache(app.server, config={
-    'CACHE_TYPE': 'redis',
+    # the redis and filesystem caches, with the values compressed
+    # (see cache_backends.py). use 'cache_backends.ShardedRedisCache' with a
+    # list of CACHE_REDIS_URLS to spread the sessions over several redis nodes
+    'CACHE_TYPE': 'cache_backends.CompressedRedisCache',
     # Note that filesystem cache doesn't work on systems with ephemeral
     # filesystems like Heroku.
-    'CACHE_TYPE': 'filesystem',
+    'CACHE_TYPE': 'cache_backends.CompressedFileSystemCache',
     'CACHE_DIR': 'cache-directory',
 
-    # should be equal to maximum number of users on the app at a single time
-    # higher numbers will store more data in the filesystem / redis cache
-    'CACHE_THRESHOLD': 200
+    # only a backstop, the session budgets below are what keeps the
+    # cache small. higher numbers will store more data in the filesystem /
+    # redis cache
+    'CACHE_THRESHOLD': 1000
 })
 
+logger = logging.getLogger(__name__)
+
+SESSION_BYTE_BUDGET = 256 * 1024 * 1024  # bytes, for all of the sessions
+SESSION_QUOTA = 16 * 1024 * 1024  # bytes, per session
+SESSION_IDLE_TTL = 30 * 60  # seconds
+JANITOR_INTERVAL = 60  # seconds
+SESSION_LEDGER_DIR = 'session-ledger'
+SOFT_TTL = 5 * 60  # seconds
+HARD_TTL = 30 * 60  # seconds
+INVALIDATION_LOG = 'near-cache-invalidations.log'
+
+# the local copies of the sessions' data, see Near Cache in cache_backends.py.
+# with redis, pass its url to InvalidationBus
+near_cache = NearCache(cache, InvalidationBus(log_path=INVALIDATION_LOG))
+
+
+def stale_while_revalidate(soft_ttl, hard_ttl, refresh_timeout=60):
+    # serve values older than `soft_ttl` seconds while a background thread
+    # computes them again. values older than `hard_ttl` seconds are computed
+    # before returning. `refresh_timeout` bounds how long a refresh that
+    # never finishes (e.g. its process died) blocks the next one.
+    # place the decorator between @near_cache() and @near_cache.memoize()
+    def decorator(memoized):
+        def refresh(args, kwargs):
+            try:
+                with app.server.app_context():
+                    # stored (or not) like any other computed value
+                    memoized.refresh(*args, **kwargs)
+            finally:
+                cache.delete('refresh-' + memoized.stamp_key(args, kwargs))
+
+        def check_stamp(args, kwargs, stamp):
+            # whether the value with this stamp can be served, scheduling
+            # a refresh when it's stale
+            age = time.time() - stamp[1]
+            if age > hard_ttl:
+                return False
+            if age > soft_ttl:
+                # only one refresh per value, across processes
+                refresh_key = 'refresh-' + memoized.stamp_key(args, kwargs)
+                if cache.add(refresh_key, os.getpid(), timeout=refresh_timeout):
+                    thread = threading.Thread(target=refresh, args=(args, kwargs))
+                    thread.daemon = True
+                    thread.start()
+            return True
+
+        @functools.wraps(memoized)
+        def wrapper(*args, **kwargs):
+            stamp = cache.get(memoized.stamp_key(args, kwargs))
+            if stamp is not None and not check_stamp(args, kwargs, stamp):
+                cache.delete(memoized.make_cache_key(memoized.uncached, *args, **kwargs))
+            return memoized(*args, **kwargs)
+
+        wrapper.check_stamp = check_stamp
+        return wrapper
+    return decorator
+
+
+def ledger_path(session_id):
+    # session ids come from the browser, so they aren't used as file names
+    name = hashlib.sha1(session_id.encode('utf-8')).hexdigest()
+    return os.path.join(SESSION_LEDGER_DIR, name)
+
+
+def within_session_quota(data):
+    return len(data) <= SESSION_QUOTA
+
+
+def record_session_size(function):
+    # write the size of the session's data to the ledger when it's computed.
+    # place the decorator below @near_cache.memoize(response_filter=within_session_quota)
+    @functools.wraps(function)
+    def wrapper(session_id):
+        data = function(session_id)
+        if not within_session_quota(data):
+            logger.warning('Session %s computed %d bytes (quota %d), not caching it',
+                           session_id, len(data), SESSION_QUOTA)
+            return data
+        try:
+            os.makedirs(SESSION_LEDGER_DIR)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with open(ledger_path(session_id), 'w') as f:
+            json.dump({'session_id': session_id, 'bytes': len(data)}, f)
+        return data
+    return wrapper
+
+
+def touch_session(session_id):
+    # the modification time of the ledger file is the last access
+    try:
+        os.utime(ledger_path(session_id), None)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def evict_session(session_id, path):
+    query_and_serialize_data.invalidate(session_id)
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def sweep_sessions():
+    now = time.time()
+    sessions = []
+    for name in os.listdir(SESSION_LEDGER_DIR):
+        path = os.path.join(SESSION_LEDGER_DIR, name)
+        try:
+            last_access = os.path.getmtime(path)
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            # removed, or still being written
+            continue
+        sessions.append((last_access, entry['bytes'], entry['session_id'], path))
+
+    # least recently used first
+    sessions.sort()
+    total = sum(size for _, size, _, _ in sessions)
+    for last_access, size, session_id, path in sessions:
+        if total <= SESSION_BYTE_BUDGET:
+            if now - last_access <= SESSION_IDLE_TTL:
+                break
+            # the session may have been used since the ledger was listed
+            try:
+                if now - os.path.getmtime(path) <= SESSION_IDLE_TTL:
+                    continue
+            except OSError:
+                continue
+        evict_session(session_id, path)
+        total -= size
+
+
+def run_janitor():
+    lock_path = SESSION_LEDGER_DIR + '.lock'
+    while True:
+        time.sleep(JANITOR_INTERVAL)
+        with open(lock_path, 'a') as lock_file:
+            # skip this sweep if another process is already sweeping.
+            # the lock is released if that process dies
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                continue
+            try:
+                if os.path.isdir(SESSION_LEDGER_DIR):
+                    sweep_sessions()
+            except Exception:
+                logger.exception('Session sweep failed')
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+janitor = {'pid': None, 'lock': threading.Lock()}
+
+
+def start_janitor():
+    # once per process. the pid changes when a worker is forked
+    # from a parent that had already started its own janitor
+    if janitor['pid'] == os.getpid():
+        return
+    with janitor['lock']:
+        if janitor['pid'] != os.getpid():
+            janitor['pid'] = os.getpid()
+            thread = threading.Thread(target=run_janitor)
+            thread.daemon = True
+            thread.start()
+
+
+@near_cache(decode=decode_frame)
+@stale_while_revalidate(soft_ttl=SOFT_TTL, hard_ttl=HARD_TTL)
+@near_cache.memoize(timeout=0, response_filter=within_session_quota)
+@record_session_size
+def query_and_serialize_data(session_id):
+    # expensive or user/session-unique data processing step goes here
+
+    # simulate a user/session-unique data processing step by generating
+    # data that is dependent on time
+    now = datetime.datetime.now()
+
+    # simulate an expensive data processing task by sleeping
+    time.sleep(5)
+
+    df = pd.DataFrame({
+        'time': [
+            str(now - datetime.timedelta(seconds=15)),
+            str(now - datetime.timedelta(seconds=10)),
+            str(now - datetime.timedelta(seconds=5)),
+            str(now)
+        ],
+        'values': ['a', 'b', 'a', 'c']
+    })
+    return encode_frame(df)
+
 
 def get_dataframe(session_id):
-    @cache.memoize()
-    def query_and_serialize_data(session_id):
-        # expensive or user/session-unique data processing step goes here
-
-        # simulate a user/session-unique data processing step by generating
-        # data that is dependent on time
-        now = datetime.datetime.now()
-
-        # simulate an expensive data processing task by sleeping
-        time.sleep(5)
-
-        df = pd.DataFrame({
-            'time': [
-                str(now - datetime.timedelta(seconds=15)),
-                str(now - datetime.timedelta(seconds=10)),
-                str(now - datetime.timedelta(seconds=5)),
-                str(now)
-            ],
-            'values': ['a', 'b', 'a', 'c']
-        })
-        return df.to_json()
-
-    return pd.read_json(query_and_serialize_data(session_id))
+    # the janitor deletes the data of idle sessions, so it's stored
+    # without a timeout. near_cache decodes the data into a dataframe
+    start_janitor()
+    df = query_and_serialize_data(session_id)
+    touch_session(session_id)
+    return df
 
 
 def serve_layout():
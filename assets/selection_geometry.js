@@ -0,0 +1,28 @@
+// Reduce a graph's selectedData to the geometry of the selection.
+//
+// selectedData carries one entry per selected point, so posting it to the
+// server makes the request grow with the size of the selection. These
+// clientside functions run in the browser and keep only the selection range
+// (box select) or the lasso polygon, so the request stays the same size no
+// matter how many points are selected. The server resolves membership itself.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    selection: {
+        geometry: function(selectedData) {
+            if (!selectedData) {
+                return null;
+            }
+            if (selectedData.range) {
+                return {'range': selectedData.range};
+            }
+            if (selectedData.lassoPoints) {
+                return {'lassoPoints': selectedData.lassoPoints};
+            }
+            // click selections have no geometry, keep only the point ids
+            return {
+                'customdata': (selectedData.points || []).map(function(p) {
+                    return p.customdata;
+                })
+            };
+        }
+    }
+});
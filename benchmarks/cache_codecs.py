@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark: serializing cached dataframes
+
+Part 6B (app.21.py) lets the cache pickle global_store's dataframes, and Part 6C
+(app.22.py) caches df.to_json() and parses it again with pd.read_json on every
+hit. This script compares the cost of a cache hit (decode) and of a computation
+(encode) with these codecs:
+
+    - json   - df.to_json(date_format='iso', orient='split') / pd.read_json
+    - pickle - pickle.dumps / pickle.loads, the default of the cache backends
+    - arrow  - uncompressed Arrow IPC stream / read_pandas
+    - codec  - encode_frame / decode_frame in cache_backends.py: pickle protocol
+               5 with the column buffers kept out of band, decoded without copies
+
+for frames of 1 KB to 1 GB (in memory). JSON is skipped above JSON_MAX_BYTES, it
+would take minutes. The 1 GB frame needs about 4 GB of memory.
+
+    $ python benchmarks/cache_codecs.py
+"""
+
+import gc
+import io
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cache_backends import encode_frame, decode_frame  # noqa: E402
+
+SIZES = [1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2, 1024 ** 3]  # bytes
+JSON_MAX_BYTES = 100 * 1024 ** 2
+REPEAT = 5
+LARGE_REPEAT = 1  # for frames of 100 MB and more
+
+
+def encode_json(df):
+    return df.to_json(date_format='iso', orient='split')
+
+
+def decode_json(payload):
+    return pd.read_json(io.StringIO(payload), orient='split')
+
+
+def encode_pickle(df):
+    return pickle.dumps(df, pickle.HIGHEST_PROTOCOL)
+
+
+def encode_arrow(df):
+    table = pa.Table.from_pandas(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def decode_arrow(payload):
+    return pa.ipc.open_stream(payload).read_pandas()
+
+
+CODECS = [
+    ('json', encode_json, decode_json),
+    ('pickle', encode_pickle, pickle.loads),
+    ('arrow', encode_arrow, decode_arrow),
+    ('codec', encode_frame, decode_frame),
+]
+
+
+def make_frame(n_bytes):
+    # 33 bytes per row: three 8 byte columns, a datetime and a category
+    n_rows = max(1, n_bytes // 33)
+    np.random.seed(0)
+    return pd.DataFrame({
+        'time': pd.date_range('2020-01-01', periods=n_rows, freq='s'),
+        'fruit': pd.Categorical.from_codes(
+            np.random.randint(0, 3, n_rows).astype(np.int8),
+            ['apples', 'oranges', 'figs']),
+        'count': np.random.randint(0, 1000, n_rows),
+        'x': np.random.randn(n_rows),
+        'y': np.random.randn(n_rows),
+    })
+
+
+def best_time(repeat, function, *args):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        result = None
+        gc.collect()
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def format_bytes(n_bytes):
+    for unit in ['B', 'KB', 'MB']:
+        if n_bytes < 1024:
+            return '{:.0f} {}'.format(n_bytes, unit)
+        n_bytes /= 1024.0
+    return '{:.1f} GB'.format(n_bytes)
+
+
+def main():
+    print('{:>9} {:>6} {:>11} {:>12} {:>12} {:>11}'.format(
+        'frame', 'codec', 'payload', 'encode (ms)', 'decode (ms)', 'types kept'))
+    for n_bytes in SIZES:
+        df = make_frame(n_bytes)
+        size = format_bytes(df.memory_usage(index=True).sum())
+        repeat = REPEAT if n_bytes < 100 * 1024 ** 2 else LARGE_REPEAT
+        for name, encode, decode in CODECS:
+            if name == 'json' and n_bytes > JSON_MAX_BYTES:
+                print('{:>9} {:>6} {:>11}'.format(size, name, '-'))
+                continue
+            encode_time, payload = best_time(repeat, encode, df)
+            decode_time, decoded = best_time(repeat, decode, payload)
+            types_kept = list(decoded.dtypes) == list(df.dtypes)
+            print('{:>9} {:>6} {:>11} {:>12.2f} {:>12.2f} {:>11}'.format(
+                size, name, format_bytes(len(payload)), encode_time * 1000,
+                decode_time * 1000, str(types_kept)))
+            # free the memory before the next codec
+            del payload, decoded
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark: the cache backends under the access patterns of memoize
+
+app.21.py and app.22.py switch between the simple, filesystem and redis caches
+(and the backends of cache_backends.py) by changing CACHE_TYPE. This script
+replays the way `cache.memoize` uses its backend - a get, and a set of the
+computed value on a miss - against each of them:
+
+    - read-heavy   - THREADS threads look up a skewed mix of KEYS values of the
+                     size of global_store's frames (a few popular ones, many
+                     rarely used ones), almost every lookup is a hit
+    - cold-burst   - the cache is empty and THREADS threads miss on the same
+                     BURST_KEYS values at the same time, as after a deploy or an
+                     invalidation, so every thread sets every value
+    - large-frames - one thread stores and reads back LARGE_BYTES frames
+
+and reports the throughput, the 50th and 99th percentile latency of a lookup and
+the memory the backend holds afterwards (the redis INFO, the size of the cache
+files or of the pickled values of SimpleCache).
+
+The redis backends talk to Redis stand-ins (benchmarks/redis_standin.py) that
+run in threads of this process, so no redis-server is needed. They share the
+GIL with the client threads, so their numbers are a lower bound of what a real
+redis-server gives, and compare the cost of the backends' clients and encoding
+rather than of Redis itself. SimpleCache is only shared by the threads of one
+process, unlike the others.
+
+    $ python benchmarks/cache_workloads.py
+    $ python benchmarks/cache_workloads.py --backends simple,redis
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import redis
+from flask_caching.backends.filesystemcache import FileSystemCache
+from flask_caching.backends.rediscache import RedisCache
+from flask_caching.backends.simplecache import SimpleCache
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cache_backends import (  # noqa: E402
+    DEFAULT_DIR, CompressedFileSystemCache, CompressedRedisCache,
+    SharedMemoryCache, ShardedRedisCache, encode_frame)
+from redis_standin import start_standin  # noqa: E402
+
+THREADS = 8
+KEYS = 200
+THRESHOLD = 1000  # entries, above KEYS so that nothing is pruned
+FRAME_ROWS = 5000  # rows of the frames of read-heavy and cold-burst
+READ_HEAVY_LOOKUPS = 2000  # per thread
+ZIPF_EXPONENT = 1.3  # of the popularity of the keys
+BURST_KEYS = 20
+BURSTS = 5
+LARGE_BYTES = 50 * 1024 ** 2
+LARGE_KEYS = 3
+LARGE_LOOKUPS = 10
+SHARDS = 2
+
+
+def make_frame(n_rows, seed):
+    # the columns of global_store's frames in app.21.py
+    np.random.seed(seed)
+    return pd.DataFrame({
+        'category': pd.Categorical.from_codes(
+            np.random.randint(0, 4, n_rows).astype(np.int8),
+            ['apples', 'oranges', 'figs', 'pineapples']),
+        'x': np.random.randn(n_rows),
+        'y': np.random.randn(n_rows),
+    })
+
+
+def make_backends(directory, names):
+    standins = [start_standin() for _ in range(SHARDS)]
+    urls = ['redis://127.0.0.1:{}'.format(server.server_address[1])
+            for server in standins]
+    backends = [
+        ('simple', lambda: SimpleCache(threshold=THRESHOLD)),
+        ('filesystem', lambda: FileSystemCache(
+            os.path.join(directory, 'filesystem'), threshold=THRESHOLD)),
+        ('compressed-filesystem', lambda: CompressedFileSystemCache(
+            os.path.join(directory, 'compressed'), threshold=THRESHOLD)),
+        ('shared-memory', lambda: SharedMemoryCache(
+            DEFAULT_DIR + '-benchmark', threshold=THRESHOLD)),
+        ('redis', lambda: RedisCache(host=redis.from_url(urls[0]))),
+        ('compressed-redis', lambda: CompressedRedisCache(
+            host=redis.from_url(urls[0]))),
+        ('sharded-redis', lambda: ShardedRedisCache(urls)),
+    ]
+    backends = [(name, make) for name, make in backends
+                if names is None or name in names]
+    return standins, backends
+
+
+def stored_bytes(cache):
+    if isinstance(cache, ShardedRedisCache):
+        return sum(stored_bytes(shard) for shard in cache.shards.values())
+    if isinstance(cache, RedisCache):
+        return cache._write_client.info()['used_memory']
+    if isinstance(cache, SimpleCache):
+        return sum(len(value) for _, value in list(cache._cache.values()))
+    directory = cache._path if isinstance(cache, FileSystemCache) else cache._directory
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for name in os.listdir(directory))
+
+
+def lookup(cache, key, value, latencies, hits):
+    # what memoize does: get, and set the computed value on a miss
+    start = time.perf_counter()
+    if cache.get(key) is None:
+        cache.set(key, value, timeout=0)
+    else:
+        hits.append(1)
+    latencies.append(time.perf_counter() - start)
+
+
+def run_threads(n_threads, target):
+    # starts the threads together, returns the wall time until the last ends
+    barrier = threading.Barrier(n_threads + 1)
+
+    def run(thread):
+        barrier.wait()
+        target(thread)
+
+    threads = [threading.Thread(target=run, args=(thread,))
+               for thread in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def read_heavy(cache, latencies, hits):
+    values = [encode_frame(make_frame(FRAME_ROWS, seed)) for seed in range(KEYS)]
+    # a few keys get most of the lookups
+    np.random.seed(0)
+    sequences = [np.minimum(np.random.zipf(ZIPF_EXPONENT, READ_HEAVY_LOOKUPS), KEYS) - 1
+                 for _ in range(THREADS)]
+
+    def run(thread):
+        for i in sequences[thread]:
+            lookup(cache, 'global_store-{}'.format(i), values[i], latencies, hits)
+
+    return run_threads(THREADS, run)
+
+
+def cold_burst(cache, latencies, hits):
+    values = [encode_frame(make_frame(FRAME_ROWS, seed)) for seed in range(BURST_KEYS)]
+    elapsed = 0
+    for burst in range(BURSTS):
+        cache.clear()
+
+        def run(thread):
+            # every thread asks for the keys in its own order
+            for i in np.roll(np.arange(BURST_KEYS), thread):
+                lookup(cache, 'global_store-{}-{}'.format(burst, i),
+                       values[i], latencies, hits)
+
+        elapsed += run_threads(THREADS, run)
+    return elapsed
+
+
+def large_frames(cache, latencies, hits):
+    n_rows = LARGE_BYTES // 17  # bytes per row of make_frame
+    values = [encode_frame(make_frame(n_rows, seed)) for seed in range(LARGE_KEYS)]
+
+    def run(thread):
+        for i in range(LARGE_LOOKUPS):
+            key = i % LARGE_KEYS
+            lookup(cache, 'global_store-large-{}'.format(key), values[key],
+                   latencies, hits)
+
+    return run_threads(1, run)
+
+
+WORKLOADS = [
+    ('read-heavy', read_heavy),
+    ('cold-burst', cold_burst),
+    ('large-frames', large_frames),
+]
+
+
+def format_bytes(n_bytes):
+    for unit in ['B', 'KB', 'MB']:
+        if n_bytes < 1024:
+            return '{:.0f} {}'.format(n_bytes, unit)
+        n_bytes /= 1024.0
+    return '{:.1f} GB'.format(n_bytes)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', help='comma separated, instead of all of them')
+    parser.add_argument('--workloads', help='comma separated, instead of all of them')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='cache-workloads-')
+    standins, backends = make_backends(
+        directory, args.backends.split(',') if args.backends else None)
+    workloads = [(name, workload) for name, workload in WORKLOADS
+                 if not args.workloads or name in args.workloads.split(',')]
+    try:
+        print('{:<13} {:<22} {:>10} {:>9} {:>9} {:>6} {:>10}'.format(
+            'workload', 'backend', 'lookups/s', 'p50 (ms)', 'p99 (ms)',
+            'hits', 'memory'))
+        for workload_name, workload in workloads:
+            for backend_name, make_cache in backends:
+                cache = make_cache()
+                cache.clear()
+                latencies, hits = [], []
+                elapsed = workload(cache, latencies, hits)
+                p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+                print('{:<13} {:<22} {:>10.0f} {:>9.2f} {:>9.2f} {:>6.0%} {:>10}'.format(
+                    workload_name, backend_name, len(latencies) / elapsed, p50,
+                    p99, len(hits) / float(len(latencies)),
+                    format_bytes(stored_bytes(cache))))
+                # free the memory before the next backend
+                cache.clear()
+            print('')
+    finally:
+        for server in standins:
+            server.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+        shutil.rmtree(DEFAULT_DIR + '-benchmark', ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark: JSON vs. Arrow IPC transport for intermediate data
+
+Part 6A (app.20a.py) stores the cleaned dataframe in a hidden div so that the
+other callbacks can read it. This script compares the two ways of serializing
+that dataframe:
+
+    - json  - df.to_json(date_format='iso', orient='split') / pd.read_json
+    - arrow - compressed Arrow IPC stream, base64-encoded (encode_arrow_frame /
+              decode_arrow_frame in cache_backends.py)
+
+For a few frame sizes it reports the payload size sent to the browser and the
+best encode and decode time out of a few runs. It also checks that the column
+types survive the round trip.
+
+    $ pip install pyarrow
+    $ python benchmarks/intermediate_transport.py
+"""
+
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cache_backends import decode_arrow_frame, encode_arrow_frame  # noqa: E402
+
+SIZES = [1000, 10000, 100000, 1000000]
+REPEAT = 5
+
+
+def encode_json(df):
+    return df.to_json(date_format='iso', orient='split')
+
+
+def decode_json(payload):
+    return pd.read_json(io.StringIO(payload), orient='split')
+
+
+TRANSPORTS = [
+    ('json', encode_json, decode_json),
+    ('arrow', encode_arrow_frame, decode_arrow_frame),
+]
+
+
+def make_frame(n_rows):
+    np.random.seed(0)
+    return pd.DataFrame({
+        'time': pd.date_range('2020-01-01', periods=n_rows, freq='s'),
+        'fruit': np.random.choice(['apples', 'oranges', 'figs'], n_rows),
+        'count': np.random.randint(0, 1000, n_rows),
+        'x': np.random.randn(n_rows),
+        'y': np.random.randn(n_rows),
+    })
+
+
+def best_time(function, *args):
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    print('{:>9} {:>6} {:>12} {:>11} {:>11} {:>13}'.format(
+        'rows', 'codec', 'payload (B)', 'encode (ms)', 'decode (ms)',
+        'types kept'))
+    for n_rows in SIZES:
+        df = make_frame(n_rows)
+        for name, encode, decode in TRANSPORTS:
+            encode_time, payload = best_time(encode, df)
+            decode_time, decoded = best_time(decode, payload)
+            types_kept = list(decoded.dtypes) == list(df.dtypes)
+            print('{:>9} {:>6} {:>12} {:>11.1f} {:>11.1f} {:>13}'.format(
+                n_rows, name, len(payload), encode_time * 1000,
+                decode_time * 1000, str(types_kept)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+
+"""
+A Redis stand-in for tests and benchmarks
+
+Speaks enough of the Redis protocol (RESP2, and RESP3 after HELLO 3, which
+redis-py sends by default) for flask_caching's RedisCache and the examples of
+Part 6: strings with expiry, counters, KEYS, FLUSHDB, INFO, transactions
+(WATCH / MULTI / EXEC) and PUBLISH / SUBSCRIBE. Everything is kept in a dictionary in memory, so it's only
+meant to run several "nodes" on one machine when no redis-server is installed.
+
+Run a node in its own process:
+
+    $ python benchmarks/redis_standin.py --port 6390
+
+or in a thread of the current process:
+
+    server = start_standin(port=0)  # 0 picks a free port
+    url = 'redis://127.0.0.1:{}'.format(server.server_address[1])
+    ...
+    server.shutdown()
+"""
+
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+
+
+class Store(object):
+
+    def __init__(self):
+        # reentrant, for the commands of EXEC
+        self.lock = threading.RLock()
+        self.values = {}
+        self.expires = {}
+        self.changes = {}  # key -> number of writes, for WATCH
+        self.flushes = 0
+        self.subscribers = {}  # channel -> set of handlers
+
+    def alive(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.time():
+            self.delete(key)
+        return key in self.values
+
+    def version(self, key):
+        self.alive(key)
+        return self.flushes, self.changes.get(key, 0)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+        self.expires.pop(key, None)
+        self.changes[key] = self.changes.get(key, 0) + 1
+
+    def set(self, key, value, seconds=None):
+        self.changes[key] = self.changes.get(key, 0) + 1
+        self.values[key] = value
+        if seconds is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = time.time() + seconds
+
+    def increment(self, key, delta):
+        value = int(self.values[key]) if self.alive(key) else 0
+        value += delta
+        self.set(key, str(value).encode('ascii'), None)
+        return value
+
+    def memory(self):
+        return sum(len(key) + len(value) for key, value in self.values.items())
+
+
+class Error(Exception):
+    pass
+
+
+class Push(list):
+    # a pub/sub message, which RESP3 sends with its own type
+    pass
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # an inline command, e.g. from telnet
+            return line.split()
+        arguments = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            arguments.append(self.rfile.read(length + 2)[:-2])
+        return arguments
+
+    def encode(self, reply):
+        resp3 = self.protocol == 3
+        if reply is None:
+            return b'_\r\n' if resp3 else b'$-1\r\n'
+        if isinstance(reply, Error):
+            return '-ERR {}\r\n'.format(reply).encode('utf-8')
+        if isinstance(reply, bool):
+            return ':{}\r\n'.format(int(reply)).encode('ascii')
+        if isinstance(reply, int):
+            return ':{}\r\n'.format(reply).encode('ascii')
+        if isinstance(reply, str):
+            return '+{}\r\n'.format(reply).encode('utf-8')
+        if isinstance(reply, dict):
+            if not resp3:
+                return self.encode([item for pair in reply.items() for item in pair])
+            return b'%' + str(len(reply)).encode('ascii') + b'\r\n' + \
+                b''.join(self.encode(key) + self.encode(value)
+                         for key, value in reply.items())
+        if isinstance(reply, (list, tuple)):
+            kind = b'>' if resp3 and isinstance(reply, Push) else b'*'
+            return kind + str(len(reply)).encode('ascii') + b'\r\n' + \
+                b''.join(self.encode(item) for item in reply)
+        return b'$' + str(len(reply)).encode('ascii') + b'\r\n' + reply + b'\r\n'
+
+    def send(self, reply):
+        with self.write_lock:
+            self.wfile.write(self.encode(reply))
+            self.wfile.flush()
+
+    def handle(self):
+        self.write_lock = threading.Lock()
+        self.channels = set()
+        self.protocol = 2
+        self.watched = {}  # key -> version, for EXEC
+        self.queued = None  # the commands after MULTI
+        try:
+            while True:
+                command = self.read_command()
+                if command is None:
+                    break
+                if not command:
+                    continue
+                name = command[0].decode('ascii').upper()
+                if self.queued is not None and name not in ('EXEC', 'DISCARD', 'MULTI', 'WATCH'):
+                    self.queued.append((name, command[1:]))
+                    self.send('QUEUED')
+                    continue
+                try:
+                    reply = self.execute(name, command[1:])
+                except Error as e:
+                    reply = e
+                except (ValueError, IndexError):
+                    reply = Error('wrong arguments for {}'.format(name))
+                if name in ('SUBSCRIBE', 'UNSUBSCRIBE'):
+                    # one reply per channel
+                    for item in reply:
+                        self.send(item)
+                else:
+                    self.send(reply)
+                if name == 'QUIT':
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self.server.store.lock:
+                for channel in self.channels:
+                    self.server.store.subscribers[channel].discard(self)
+
+    def execute(self, name, args):
+        store = self.server.store
+        with store.lock:
+            if name == 'PING':
+                return args[0] if args else 'PONG'
+            if name == 'ECHO':
+                return args[0]
+            if name in ('SELECT', 'CLIENT', 'QUIT'):
+                return 'OK'
+            if name == 'COMMAND':
+                return []
+            if name == 'HELLO':
+                if args:
+                    self.protocol = int(args[0])
+                return {b'server': b'redis', b'version': b'7.0.0',
+                        b'proto': self.protocol, b'mode': b'standalone',
+                        b'role': b'master', b'modules': []}
+            if name == 'GET':
+                return store.values[args[0]] if store.alive(args[0]) else None
+            if name == 'MGET':
+                return [store.values[key] if store.alive(key) else None
+                        for key in args]
+            if name == 'SET':
+                options = [option.upper() for option in args[2:]]
+                seconds = None
+                if b'EX' in options:
+                    seconds = int(args[2 + options.index(b'EX') + 1])
+                if b'PX' in options:
+                    seconds = int(args[2 + options.index(b'PX') + 1]) / 1000.0
+                exists = store.alive(args[0])
+                if (b'NX' in options and exists) or (b'XX' in options and not exists):
+                    return None
+                store.set(args[0], args[1], seconds)
+                return 'OK'
+            if name == 'SETEX':
+                store.set(args[0], args[2], int(args[1]))
+                return 'OK'
+            if name == 'PSETEX':
+                store.set(args[0], args[2], int(args[1]) / 1000.0)
+                return 'OK'
+            if name == 'SETNX':
+                if store.alive(args[0]):
+                    return 0
+                store.set(args[0], args[1])
+                return 1
+            if name == 'MSET':
+                for key, value in zip(args[::2], args[1::2]):
+                    store.set(key, value)
+                return 'OK'
+            if name in ('DEL', 'UNLINK'):
+                deleted = [key for key in args if store.alive(key)]
+                for key in deleted:
+                    store.delete(key)
+                return len(deleted)
+            if name == 'EXISTS':
+                return sum(store.alive(key) for key in args)
+            if name in ('EXPIRE', 'PEXPIRE'):
+                if not store.alive(args[0]):
+                    return 0
+                seconds = int(args[1]) / (1000.0 if name == 'PEXPIRE' else 1)
+                store.expires[args[0]] = time.time() + seconds
+                return 1
+            if name == 'TTL':
+                if not store.alive(args[0]):
+                    return -2
+                if args[0] not in store.expires:
+                    return -1
+                return int(round(store.expires[args[0]] - time.time()))
+            if name in ('INCR', 'DECR', 'INCRBY', 'DECRBY'):
+                delta = int(args[1]) if name.endswith('BY') else 1
+                if name.startswith('DECR'):
+                    delta = -delta
+                try:
+                    return store.increment(args[0], delta)
+                except ValueError:
+                    raise Error('value is not an integer or out of range')
+            if name == 'KEYS':
+                pattern = args[0].decode('utf-8')
+                return [key for key in list(store.values) if store.alive(key)
+                        and fnmatch.fnmatchcase(key.decode('utf-8', 'replace'), pattern)]
+            if name == 'DBSIZE':
+                return sum(store.alive(key) for key in list(store.values))
+            if name in ('FLUSHDB', 'FLUSHALL'):
+                store.values.clear()
+                store.expires.clear()
+                store.flushes += 1
+                return 'OK'
+            if name == 'WATCH':
+                for key in args:
+                    self.watched[key] = store.version(key)
+                return 'OK'
+            if name == 'UNWATCH':
+                self.watched.clear()
+                return 'OK'
+            if name == 'MULTI':
+                self.queued = []
+                return 'OK'
+            if name == 'DISCARD':
+                self.queued = None
+                self.watched.clear()
+                return 'OK'
+            if name == 'EXEC':
+                queued, self.queued = self.queued, None
+                watched = dict(self.watched)
+                self.watched.clear()
+                if queued is None:
+                    raise Error('EXEC without MULTI')
+                if any(store.version(key) != version
+                       for key, version in watched.items()):
+                    # a watched key changed, nothing is run
+                    return None
+                replies = []
+                for queued_name, queued_args in queued:
+                    try:
+                        replies.append(self.execute(queued_name, queued_args))
+                    except Error as e:
+                        replies.append(e)
+                return replies
+            if name == 'INFO':
+                return '# Memory\r\nused_memory:{}\r\n'.format(
+                    store.memory()).encode('ascii')
+            if name == 'PUBLISH':
+                receivers = list(store.subscribers.get(args[0], ()))
+                for handler in receivers:
+                    handler.send(Push([b'message', args[0], args[1]]))
+                return len(receivers)
+            if name == 'SUBSCRIBE':
+                replies = []
+                for channel in args:
+                    store.subscribers.setdefault(channel, set()).add(self)
+                    self.channels.add(channel)
+                    replies.append(Push([b'subscribe', channel, len(self.channels)]))
+                return replies
+            if name == 'UNSUBSCRIBE':
+                replies = []
+                for channel in args or list(self.channels):
+                    store.subscribers.get(channel, set()).discard(self)
+                    self.channels.discard(channel)
+                    replies.append(Push([b'unsubscribe', channel, len(self.channels)]))
+                return replies
+        raise Error("unknown command '{}'".format(name))
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address):
+        socketserver.ThreadingTCPServer.__init__(self, address, Handler)
+        self.store = Store()
+
+
+def start_standin(host='127.0.0.1', port=0):
+    server = StandInServer((host, port))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    StandInServer((args.host, args.port)).serve_forever()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark: sharding the cache over several Redis nodes
+
+Starts NODES stand-in Redis processes (benchmarks/redis_standin.py, so no
+redis-server is needed, or pass the URLs of real nodes with --urls) and, for the
+ShardedRedisCache backend in cache_backends.py:
+
+    - writes KEYS values and reports how many keys, and bytes, each node holds
+    - reads every value back through the ring
+    - compares the fraction of the keys that move to another node when a node is
+      added or removed with consistent hashing and with `hash(key) % nodes`
+    - measures the throughput of get and set with THREADS client threads on 1
+      node and on every node
+
+The stand-ins are single Python processes, so the throughput only grows with the
+number of nodes when the machine has cores to spare.
+
+    $ python benchmarks/sharded_cache.py
+    $ python benchmarks/sharded_cache.py --urls redis://10.0.0.1:6379,redis://10.0.0.2:6379
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cache_backends import HashRing, ShardedRedisCache, ring_hash  # noqa: E402
+
+NODES = 4
+FIRST_PORT = 6390
+KEYS = 20000
+VALUE_BYTES = 512
+THREADS = 8
+DURATION = 2.0  # seconds, per throughput measurement
+
+
+def start_nodes(n_nodes):
+    standin = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'redis_standin.py')
+    processes = []
+    urls = []
+    for port in range(FIRST_PORT, FIRST_PORT + n_nodes):
+        processes.append(subprocess.Popen(
+            [sys.executable, standin, '--port', str(port)]))
+        urls.append('redis://127.0.0.1:{}'.format(port))
+    # wait until every node answers
+    for url in urls:
+        client = redis.from_url(url)
+        for _ in range(100):
+            try:
+                client.ping()
+                break
+            except redis.ConnectionError:
+                time.sleep(0.05)
+    return processes, urls
+
+
+def moved_fraction(keys, before, after):
+    return sum(before(key) != after(key) for key in keys) / float(len(keys))
+
+
+def throughput(cache, keys, operation):
+    # operations per second over every thread
+    done = [0] * THREADS
+    stop = time.time() + DURATION
+
+    def run(thread):
+        value = b'x' * VALUE_BYTES
+        i = thread
+        while time.time() < stop:
+            key = keys[i % len(keys)]
+            if operation == 'set':
+                cache.set(key, value)
+            else:
+                cache.get(key)
+            i += THREADS
+            done[thread] += 1
+
+    threads = [threading.Thread(target=run, args=(thread,))
+               for thread in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done) / DURATION
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--urls', help='comma separated, instead of stand-ins')
+    args = parser.parse_args()
+
+    processes = []
+    if args.urls:
+        urls = args.urls.split(',')
+    else:
+        processes, urls = start_nodes(NODES)
+    try:
+        keys = ['key-{}'.format(i) for i in range(KEYS)]
+        cache = ShardedRedisCache(urls)
+        cache.clear()
+
+        print('Distribution of {} keys over {} nodes'.format(KEYS, len(urls)))
+        for key in keys:
+            cache.set(key, os.urandom(VALUE_BYTES))
+        for url, shard in cache.shards.items():
+            client = shard._write_client
+            print('  {:<26} {:>7} keys {:>12} bytes'.format(
+                url, client.dbsize(), client.info()['used_memory']))
+        missing = sum(value is None for value in cache.get_many(*keys))
+        print('  values read back: {}, missing: {}'.format(KEYS - missing, missing))
+
+        print('\nKeys moved when the nodes change')
+        nodes = ['node-{}'.format(i) for i in range(len(urls) + 1)]
+        ring, bigger_ring = HashRing(nodes[:-1]), HashRing(nodes)
+        print('  {:<20} {:>12} {:>12}'.format('', 'consistent', 'modulo'))
+        for label, before, after, n_before, n_after in [
+                ('add a node', ring, bigger_ring, len(nodes) - 1, len(nodes)),
+                ('remove a node', bigger_ring, ring, len(nodes), len(nodes) - 1)]:
+            print('  {:<20} {:>11.1%} {:>11.1%}'.format(
+                label, moved_fraction(keys, before.node, after.node),
+                moved_fraction(keys, lambda key: ring_hash(key) % n_before,
+                               lambda key: ring_hash(key) % n_after)))
+
+        print('\nThroughput with {} threads (operations / s)'.format(THREADS))
+        for label, node_urls in [('1 node', urls[:1]),
+                                 ('{} nodes'.format(len(urls)), urls)]:
+            sharded = ShardedRedisCache(node_urls)
+            print('  {:<10} set {:>9.0f}   get {:>9.0f}'.format(
+                label, throughput(sharded, keys, 'set'),
+                throughput(sharded, keys, 'get')))
+        cache.clear()
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1233 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cache backends for flask_caching
+
+Select them with the import path of the class as the CACHE_TYPE, e.g.
+
+    cache = Cache(app.server, config={
+        'CACHE_TYPE': 'cache_backends.SharedMemoryCache',
+    })
+
+SharedMemoryCache
+
+Shares cached values between the processes of a single machine without running
+Redis. Every entry is a file in a shared memory filesystem (/dev/shm when there is
+one, so nothing is written to the disk), and the directory is the index of the
+entries. The numeric, boolean and datetime columns of a DataFrame (and its index)
+are stored as raw buffers after a small header, and get maps the file and wraps
+those buffers in numpy arrays, so reading a cached frame doesn't copy or unpickle
+its data. Bytes (like the values of encode_frame below) are stored as they are too,
+and get returns them as a memoryview of the mapped entry, not as bytes (call
+bytes() on it for a copy). The other columns (including timezone-aware
+datetimes, categoricals and the other pandas extension dtypes), and every other
+value, are pickled.
+
+The entries are mapped copy-on-write: the frames returned by get can be modified
+like any other, and the pages that are written to are copied for that process
+only, so the cached entry doesn't change. A mapped entry stays valid after it is
+replaced or deleted: the memory is released once the last frame using it is
+garbage collected.
+
+Options (in the app config):
+
+    - CACHE_DIR - the directory of the entries, by default
+      /dev/shm/dash-shared-memory-cache
+    - CACHE_THRESHOLD - the maximum number of entries before the oldest ones
+      are deleted. the entries are only counted every few writes, so there can
+      be up to 1 / PRUNE_FRACTION more of them in between (for each process)
+
+Zero-Copy Codec
+
+encode_frame and decode_frame serialize cache values (dataframes in particular)
+for the other backends. The value is pickled with protocol 5, which hands the
+column buffers over separately instead of copying them into the pickle, and the
+buffers are appended after the pickle, aligned. decode_frame unpickles the small
+pickle with views of those buffers, so the columns of the decoded frame wrap the
+encoded bytes instead of being parsed from text or copied. The frames decoded
+from bytes are read-only; the ones decoded from a SharedMemoryCache memoryview
+are copy-on-write like its frames.
+
+    @near_cache(decode=decode_frame)
+    @cache.memoize()
+    def query(value):
+        return encode_frame(df)
+
+See benchmarks/cache_codecs.py for a comparison with JSON, pickle and Arrow.
+
+Arrow Codec
+
+encode_arrow_frame and decode_arrow_frame write a dataframe as an Arrow IPC stream
+compressed with ARROW_COMPRESSION and base64-encoded, so that it can also be
+stored in the browser like any other string (see Part 6A, app.20a.py). Every
+column keeps its type. Be sure to pip install pyarrow.
+
+CompressedRedisCache and CompressedFileSystemCache
+
+The redis and filesystem backends, with their values compressed, e.g.
+
+    'CACHE_TYPE': 'cache_backends.CompressedRedisCache'
+
+The codec is picked for each value:
+
+    - values smaller than COMPRESS_MIN_BYTES are stored as they are
+    - a sample of the value is compressed first, and values that don't compress
+      to at least 1 / COMPRESS_MIN_RATIO of their size are stored as they are
+    - values of ZSTD_MIN_BYTES or more use zstd, which compresses the large
+      dataframes that take most of the memory the best, and the others use lz4,
+      which is the fastest to decompress
+
+lz4 and zstd come from pyarrow. Without it, every value is compressed with zlib.
+Values stored before compression was turned on can still be read. Each value is
+pickled once, and CompressedFileSystemCache tags it with a byte that tells whether
+it was compressed, so a value that happens to look compressed is read back as it
+is.
+
+The number of values, their raw and stored sizes and the time spent compressing
+and decompressing them are counted for each codec in this process, see
+compression_report.
+
+ShardedRedisCache
+
+Spreads the keys over several Redis nodes, so that the cache can hold and serve
+more than a single node:
+
+    'CACHE_TYPE': 'cache_backends.ShardedRedisCache',
+    'CACHE_REDIS_URLS': ['redis://cache-1:6379', 'redis://cache-2:6379'],
+
+Each node gets SHARD_REPLICAS points on a hash ring and a key belongs to the node
+of the first point after the hash of the key (consistent hashing). When a node is
+added, it only takes over the keys that fall just before its points, about
+1 / (number of nodes) of them, and when one is removed only its own keys move: the
+other keys stay where they are and remain cached. The nodes store their values
+compressed, as with CompressedRedisCache.
+
+See benchmarks/sharded_cache.py to try it on local stand-in nodes.
+
+Argument Hashing
+
+cache.memoize keys the values on str() of the arguments. That's slow for large
+arguments and, worse, wrong for dataframes and arrays, whose str() only shows
+their first and last rows. argument_hash hashes them by content instead: the
+buffers of numeric arrays and columns are hashed directly (with xxh3 if xxhash is
+installed, sha1 otherwise), other columns with pd.util.hash_pandas_object, and
+dictionaries and sets don't depend on their order. Plotly figures are hashed by
+their to_plotly_json(), other objects by their to_dict() or else their pickle,
+and a TypeError is raised for objects that can't be pickled. The hash is the
+same in every process. Place @stable_keys right above @cache.memoize() to key a function on
+the argument_hash of its arguments:
+
+    @stable_keys
+    @cache.memoize()
+    def summarize(df, options):
+        ...
+
+store_intermediate(cache, payload) stores intermediate data (see Part 6A) under
+the argument_hash of its content and returns the key.
+
+Near Cache
+
+Even a cache hit goes over the network to Redis (or to the disk) and decodes the
+whole value. A NearCache keeps the most recently used values in the memory of each
+process as well, so a warm hit is a dictionary lookup:
+
+    near_cache = NearCache(cache, InvalidationBus(REDIS_URL))
+
+    @near_cache(decode=decode_frame)
+    @near_cache.memoize()
+    def query(value):
+        return encode_frame(df)
+
+near_cache.memoize is cache.memoize keyed with stable_keys, and it writes a small
+version stamp (a random id and the time) to the shared cache every time a value
+is actually computed, right after the value is stored. A process only keeps using
+its local copy while the stamp hasn't changed, and it only checks the stamp once
+every `check_interval` seconds. Use `query.invalidate(value)` rather than
+cache.delete_memoized to remove a value, so that its stamp goes too. The local
+copies live as long as the process, so they need long-lived workers (gunicorn,
+or a threaded server): a server that forks a process per request starts every
+request with an empty near cache.
+
+With the stamps alone, the other processes keep serving a removed or recomputed
+value for up to `check_interval` seconds. With an InvalidationBus, `invalidate`
+and every new stamp are also broadcast to the other processes: over Redis pub/sub,
+or, without a redis url, by appending them to a log file that every process tails
+every INVALIDATION_POLL_INTERVAL seconds (which only reaches the processes of a
+single machine). The log is rotated once it's INVALIDATION_LOG_BYTES long (a
+listener that falls a whole log behind misses messages). Each process starts a
+listener thread the first time it uses a near cache and drops the local copies
+named in the messages of the other processes. When the listener loses Redis, it
+subscribes again with an increasing delay and then drops every local copy, since
+it may have missed messages. The stamps remain as a safety net, e.g. while a
+process is starting.
+"""
+
+import bisect
+import collections
+import errno
+import fcntl
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import mmap
+import os
+import pickle
+import base64
+import socket
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+
+import numpy as np
+import pandas as pd
+import redis
+from flask_caching.backends.base import BaseCache
+from flask_caching.backends.filesystemcache import FileSystemCache
+from flask_caching.backends.rediscache import RedisCache
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+logger = logging.getLogger(__name__)
+
+
+ALIGNMENT = 64  # bytes, between the buffers of a frame
+HEADER = struct.Struct('<Q')  # the length of the pickled header
+ENTRY = struct.Struct('<Qd')  # the length of the header and the expiry of an entry
+COUNT = struct.Struct('<I')  # the number of out-of-band buffers
+RAW_KINDS = 'biufcmM'  # numpy dtype kinds that are stored as raw buffers
+PRUNE_FRACTION = 20  # the entries are counted every threshold / PRUNE_FRACTION writes
+
+ARROW_COMPRESSION = 'zstd'
+
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_MIN_RATIO = 1.2
+COMPRESS_SAMPLE_BYTES = 64 * 1024
+ZSTD_MIN_BYTES = 256 * 1024
+# compressed values start with a zero byte, unlike the values of RedisCache
+COMPRESSED = b'\0cz'
+# the values of CompressedFileSystemCache start with one of these, unlike pickles
+TAG_COMPRESSED = b'z'
+TAG_RAW = b'r'
+CODECS = ['zlib', 'lz4', 'zstd']
+SHARD_REPLICAS = 160  # points of each node on the hash ring
+INVALIDATION_CHANNEL = 'near-cache-invalidations'
+INVALIDATION_LOG_BYTES = 1024 * 1024  # before the log is rotated
+INVALIDATION_POLL_INTERVAL = 0.1  # seconds, between reads of the log
+RECONNECT_MIN_DELAY = 0.5  # seconds, doubled after every failed attempt
+RECONNECT_MAX_DELAY = 30
+
+if os.path.isdir('/dev/shm'):
+    DEFAULT_DIR = os.path.join('/dev/shm', 'dash-shared-memory-cache')
+else:
+    DEFAULT_DIR = os.path.join(tempfile.gettempdir(), 'dash-shared-memory-cache')
+DEFAULT_INVALIDATION_LOG = os.path.join(
+    tempfile.gettempdir(), 'dash-near-cache', 'invalidations.log')
+
+
+def is_raw(values):
+    return isinstance(values, np.ndarray) and values.dtype.kind in RAW_KINDS
+
+
+def array_values(values):
+    # the values of a column or an index. the numpy values of timezone-aware
+    # and extension dtypes lose the dtype (e.g. to naive UTC datetimes), so
+    # those keep their pandas array, which describe_array pickles
+    if isinstance(values.dtype, np.dtype):
+        return values.to_numpy()
+    return values.array
+
+
+def describe_array(values, buffers, offset):
+    # either the position of a raw buffer in the entry, or the pickled values
+    if not is_raw(values):
+        return {'pickled': values}, offset
+    values = np.ascontiguousarray(values)
+    offset += -offset % ALIGNMENT
+    buffers.append((offset, values))
+    return {'dtype': values.dtype.str, 'offset': offset,
+            'length': len(values)}, offset + values.nbytes
+
+
+def read_array(mapped, description):
+    if 'pickled' in description:
+        return description['pickled']
+    return np.frombuffer(mapped, dtype=np.dtype(description['dtype']),
+                         count=description['length'],
+                         offset=description['offset'])
+
+
+def encode_frame(value):
+    buffers = []
+    data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+    buffers = [buffer.raw() for buffer in buffers]
+    # the number and the lengths of the buffers, the pickle, then the buffers
+    lengths = [len(data)] + [buffer.nbytes for buffer in buffers]
+    parts = [COUNT.pack(len(buffers))] + [HEADER.pack(length) for length in lengths]
+    offset = COUNT.size + HEADER.size * len(lengths)
+    for part in [data] + buffers:
+        parts.append(b'\0' * (-offset % ALIGNMENT))
+        offset += -offset % ALIGNMENT
+        parts.append(part)
+        offset += len(part) if isinstance(part, bytes) else part.nbytes
+    return b''.join(parts)
+
+
+def decode_frame(encoded):
+    encoded = memoryview(encoded)
+    count, = COUNT.unpack_from(encoded)
+    lengths = [HEADER.unpack_from(encoded, COUNT.size + HEADER.size * i)[0]
+               for i in range(count + 1)]
+    offset = COUNT.size + HEADER.size * len(lengths)
+    parts = []
+    for length in lengths:
+        offset += -offset % ALIGNMENT
+        parts.append(encoded[offset:offset + length])
+        offset += length
+    return pickle.loads(parts[0], buffers=parts[1:])
+
+
+def encode_arrow_frame(df):
+    table = pa.Table.from_pandas(df)
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression=ARROW_COMPRESSION)
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return base64.b64encode(sink.getvalue()).decode('ascii')
+
+
+def decode_arrow_frame(payload):
+    reader = pa.ipc.open_stream(pa.py_buffer(base64.b64decode(payload)))
+    return reader.read_pandas()
+
+
+compression_stats = {}
+stats_lock = threading.Lock()
+
+
+def count_compression(codec, **amounts):
+    with stats_lock:
+        stats = compression_stats.setdefault(codec, dict.fromkeys(
+            ['values', 'raw_bytes', 'stored_bytes', 'compress_ms',
+             'decompressed', 'decompress_ms'], 0))
+        for name, amount in amounts.items():
+            stats[name] += amount
+
+
+def compression_report():
+    # the totals of each codec, with the ratio and the average latencies
+    with stats_lock:
+        report = {codec: dict(stats) for codec, stats in compression_stats.items()}
+    for stats in report.values():
+        if stats.get('stored_bytes'):
+            stats['ratio'] = float(stats['raw_bytes']) / stats['stored_bytes']
+        if stats.get('values'):
+            stats['mean_compress_ms'] = stats['compress_ms'] / stats['values']
+        if stats.get('decompressed'):
+            stats['mean_decompress_ms'] = stats['decompress_ms'] / stats['decompressed']
+    return report
+
+
+def available(codec):
+    return codec == 'zlib' or (pa is not None and pa.Codec.is_available(codec))
+
+
+def compress_with(codec, data):
+    if codec == 'zlib':
+        return zlib.compress(data, 1)
+    return pa.compress(data, codec=codec, asbytes=True)
+
+
+def choose_codec(data):
+    if len(data) < COMPRESS_MIN_BYTES:
+        return None
+    fast = 'lz4' if available('lz4') else 'zlib'
+    sample = data[:COMPRESS_SAMPLE_BYTES]
+    if len(sample) < COMPRESS_MIN_RATIO * len(compress_with(fast, sample)):
+        return None
+    if len(data) >= ZSTD_MIN_BYTES and available('zstd'):
+        return 'zstd'
+    return fast
+
+
+def compress(data):
+    # the compressed value, or None when it isn't worth compressing
+    start = time.time()
+    codec = choose_codec(data)
+    if codec is None:
+        count_compression('none', values=1, raw_bytes=len(data),
+                          stored_bytes=len(data),
+                          compress_ms=(time.time() - start) * 1000)
+        return None
+    compressed = compress_with(codec, data)
+    if len(data) < COMPRESS_MIN_RATIO * len(compressed):
+        count_compression('none', values=1, raw_bytes=len(data),
+                          stored_bytes=len(data),
+                          compress_ms=(time.time() - start) * 1000)
+        return None
+    compressed = COMPRESSED + struct.pack('<BQ', CODECS.index(codec), len(data)) + \
+        compressed
+    count_compression(codec, values=1, raw_bytes=len(data),
+                      stored_bytes=len(compressed),
+                      compress_ms=(time.time() - start) * 1000)
+    return compressed
+
+
+def is_compressed(value):
+    return isinstance(value, bytes) and value.startswith(COMPRESSED)
+
+
+def decompress(value):
+    start = time.time()
+    codec, length = struct.unpack_from('<BQ', value, len(COMPRESSED))
+    codec = CODECS[codec]
+    data = memoryview(value)[len(COMPRESSED) + struct.calcsize('<BQ'):]
+    if codec == 'zlib':
+        data = zlib.decompress(data)
+    else:
+        data = pa.decompress(data, decompressed_size=length, codec=codec,
+                             asbytes=True)
+    count_compression(codec, decompressed=1,
+                      decompress_ms=(time.time() - start) * 1000)
+    return data
+
+
+class CompressedRedisCache(RedisCache):
+
+    def dump_object(self, value):
+        # integers stay strings, for INCR and DECR
+        if type(value) == int:
+            return super(CompressedRedisCache, self).dump_object(value)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return compress(data) or b'!' + data
+
+    def load_object(self, value):
+        if is_compressed(value):
+            return pickle.loads(decompress(value))
+        return super(CompressedRedisCache, self).load_object(value)
+
+
+class CompressedFileSystemCache(FileSystemCache):
+    # an entry is the pickled expiry, like with FileSystemCache, then a tag
+    # byte and the pickled value, compressed (TAG_COMPRESSED) or as it is
+    # (TAG_RAW). the entries of FileSystemCache continue with the pickled
+    # value, whose first byte is neither tag, so they can still be read
+
+    def set(self, key, value, timeout=None, mgmt_element=False):
+        if mgmt_element:
+            return super(CompressedFileSystemCache, self).set(
+                key, value, timeout=timeout, mgmt_element=mgmt_element)
+        self._prune()
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        compressed = compress(data)
+        filename = self._get_filename(key)
+        # written next to the entry and renamed, like FileSystemCache does
+        try:
+            fd, temporary = tempfile.mkstemp(
+                suffix=self._fs_transaction_suffix, dir=self._path)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(self._normalize_timeout(timeout), f, 1)
+                if compressed is None:
+                    f.write(TAG_RAW)
+                    f.write(data)
+                else:
+                    f.write(TAG_COMPRESSED)
+                    f.write(compressed)
+            is_new_file = not os.path.exists(filename)
+            os.replace(temporary, filename)
+            os.chmod(filename, self._mode)
+        except (IOError, OSError) as e:
+            logger.error('set key %r -> %s', key, e)
+            return False
+        if is_new_file:
+            self._update_count(delta=1)
+        return True
+
+    def get(self, key):
+        try:
+            with open(self._get_filename(key), 'rb') as f:
+                expires = pickle.load(f)
+                if expires != 0 and expires < time.time():
+                    self.delete(key)
+                    return None
+                data = f.read()
+        except (IOError, OSError, pickle.PickleError) as e:
+            if getattr(e, 'errno', None) != errno.ENOENT:
+                logger.error('get key %r -> %s', key, e)
+            return None
+        tag, payload = data[:1], memoryview(data)[1:]
+        if tag == TAG_COMPRESSED:
+            return pickle.loads(decompress(payload))
+        if tag == TAG_RAW:
+            return pickle.loads(payload)
+        # written by FileSystemCache, or before the tags
+        value = pickle.loads(data)
+        if is_compressed(value):
+            return pickle.loads(decompress(value))
+        return value
+
+
+def ring_hash(text):
+    return struct.unpack_from('<Q', hashlib.md5(text.encode('utf-8')).digest())[0]
+
+
+class HashRing(object):
+
+    def __init__(self, nodes, replicas=SHARD_REPLICAS):
+        # the points of a node only depend on its own name, so adding or
+        # removing a node doesn't move the points of the others
+        points = sorted((ring_hash('{}#{}'.format(node, i)), node)
+                        for node in nodes for i in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def node(self, key):
+        i = bisect.bisect(self.hashes, ring_hash(key))
+        return self.nodes[i % len(self.nodes)]
+
+
+class ShardedRedisCache(BaseCache):
+
+    def __init__(self, urls, default_timeout=300, key_prefix=None,
+                 replicas=SHARD_REPLICAS, shard_class=CompressedRedisCache):
+        super(ShardedRedisCache, self).__init__(default_timeout)
+        self.shards = collections.OrderedDict(
+            (url, shard_class(host=redis.from_url(url),
+                              default_timeout=default_timeout,
+                              key_prefix=key_prefix))
+            for url in urls)
+        self.ring = HashRing(list(self.shards), replicas)
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        urls = config['CACHE_REDIS_URLS']
+        if isinstance(urls, str):
+            urls = urls.split(',')
+        kwargs.update(dict(urls=urls, key_prefix=config.get('CACHE_KEY_PREFIX')))
+        return cls(*args, **kwargs)
+
+    def shard(self, key):
+        return self.shards[self.ring.node(key)]
+
+    def _by_shard(self, keys):
+        groups = collections.OrderedDict()
+        for key in keys:
+            groups.setdefault(self.ring.node(key), []).append(key)
+        return groups
+
+    def get(self, key):
+        return self.shard(key).get(key)
+
+    def get_many(self, *keys):
+        # one MGET per node
+        values = {}
+        for node, node_keys in self._by_shard(keys).items():
+            values.update(zip(node_keys, self.shards[node].get_many(*node_keys)))
+        return [values[key] for key in keys]
+
+    def set(self, key, value, timeout=None):
+        return self.shard(key).set(key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        return self.shard(key).add(key, value, timeout)
+
+    def set_many(self, mapping, timeout=None):
+        mapping = dict(mapping)
+        for node, node_keys in self._by_shard(mapping).items():
+            self.shards[node].set_many(
+                dict((key, mapping[key]) for key in node_keys), timeout)
+        return True
+
+    def delete(self, key):
+        return self.shard(key).delete(key)
+
+    def delete_many(self, *keys):
+        for node, node_keys in self._by_shard(keys).items():
+            self.shards[node].delete_many(*node_keys)
+        return True
+
+    def has(self, key):
+        return self.shard(key).has(key)
+
+    def clear(self):
+        for shard in self.shards.values():
+            shard.clear()
+        return True
+
+    def inc(self, key, delta=1):
+        return self.shard(key).inc(key, delta)
+
+    def dec(self, key, delta=1):
+        return self.shard(key).dec(key, delta)
+
+
+def feed(hasher, tag, data=b''):
+    # the tag and the length keep different values from hashing the same
+    hasher.update(tag + struct.pack('<Q', len(data)))
+    hasher.update(data)
+
+
+def feed_values(hasher, values):
+    # the values of an array, a column or an index
+    if is_raw(values):
+        feed(hasher, b'buffer ' + values.dtype.str.encode('ascii'),
+             np.ascontiguousarray(values).reshape(-1).view(np.uint8))
+    else:
+        try:
+            hashed = pd.util.hash_pandas_object(pd.Series(values), index=False)
+        except TypeError:
+            # unhashable objects, like lists
+            feed(hasher, b'pickled', pickle.dumps(list(values), pickle.HIGHEST_PROTOCOL))
+        else:
+            feed(hasher, b'hashed', hashed.values)
+
+
+def update_hash(hasher, value):
+    if value is None or isinstance(value, (bool, int, float, complex)):
+        feed(hasher, type(value).__name__.encode('ascii'), repr(value).encode('ascii'))
+    elif isinstance(value, str):
+        feed(hasher, b'str', value.encode('utf-8'))
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        feed(hasher, b'bytes', value)
+    elif isinstance(value, np.ndarray):
+        feed(hasher, b'ndarray', repr(value.shape).encode('ascii'))
+        if is_raw(value):
+            feed_values(hasher, value)
+        else:
+            for item in value.ravel():
+                update_hash(hasher, item)
+    elif isinstance(value, np.generic):
+        feed(hasher, value.dtype.str.encode('ascii'), value.tobytes())
+    elif isinstance(value, pd.DataFrame):
+        feed(hasher, b'DataFrame')
+        update_hash(hasher, list(value.columns))
+        for i in range(value.shape[1]):
+            column = value.iloc[:, i]
+            feed(hasher, str(column.dtype).encode('utf-8'))
+            feed_values(hasher, column.values)
+        update_hash(hasher, value.index)
+    elif isinstance(value, pd.Series):
+        feed(hasher, b'Series ' + str(value.dtype).encode('utf-8'))
+        update_hash(hasher, value.name)
+        feed_values(hasher, value.values)
+        update_hash(hasher, value.index)
+    elif isinstance(value, pd.RangeIndex):
+        feed(hasher, b'RangeIndex', repr((value.start, value.stop, value.step,
+                                          value.name)).encode('utf-8'))
+    elif isinstance(value, pd.Index):
+        feed(hasher, b'Index ' + str(value.dtype).encode('utf-8'))
+        update_hash(hasher, value.name)
+        feed_values(hasher, value.values)
+    elif isinstance(value, (list, tuple)):
+        feed(hasher, type(value).__name__.encode('ascii'),
+             struct.pack('<Q', len(value)))
+        for item in value:
+            update_hash(hasher, item)
+    elif isinstance(value, dict):
+        # in the order of the hashes of the keys, not of insertion
+        feed(hasher, b'dict', struct.pack('<Q', len(value)))
+        for key_hash, item in sorted((argument_hash(key), item)
+                                     for key, item in value.items()):
+            feed(hasher, b'key', key_hash.encode('ascii'))
+            update_hash(hasher, item)
+    elif isinstance(value, (set, frozenset)):
+        feed(hasher, b'set', ''.join(sorted(
+            argument_hash(item) for item in value)).encode('ascii'))
+    else:
+        # not repr(), which elides long arrays: plotly figures and objects with
+        # a to_dict are hashed by their content, other objects by their pickle
+        feed(hasher, b'object ' + type(value).__name__.encode('utf-8'))
+        if hasattr(value, 'to_plotly_json'):
+            update_hash(hasher, value.to_plotly_json())
+        elif hasattr(value, 'to_dict'):
+            update_hash(hasher, value.to_dict())
+        else:
+            try:
+                data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                raise TypeError('argument_hash can\'t hash {}: {}'.format(
+                    type(value).__name__, e))
+            feed(hasher, b'pickled', data)
+
+
+def argument_hash(value):
+    hasher = xxhash.xxh3_128() if xxhash is not None else hashlib.sha1()
+    update_hash(hasher, value)
+    return hasher.hexdigest()
+
+
+def bind_arguments(signature, args, kwargs):
+    # the arguments of a call as the function sees them, so that f(1),
+    # f(x=1) and a default of 1 are the same
+    arguments = signature.bind(*args, **kwargs)
+    arguments.apply_defaults()
+    return arguments.args, arguments.kwargs
+
+
+def stable_keys(memoized):
+    # key the values of the memoized function on the argument_hash of its
+    # arguments. the arguments are bound to the function's signature first,
+    # so f(1), f(x=1) and a default of 1 give the same key.
+    # place the decorator right above @cache.memoize()
+    make_cache_key = memoized.make_cache_key
+    signature = inspect.signature(memoized.uncached)
+
+    def stable_cache_key(f, *args, **kwargs):
+        args, kwargs = bind_arguments(signature, args, kwargs)
+        return make_cache_key(
+            f, *[argument_hash(value) for value in args],
+            **dict((name, argument_hash(value))
+                   for name, value in kwargs.items()))
+
+    memoized.make_cache_key = stable_cache_key
+    return memoized
+
+
+def store_intermediate(cache, payload, timeout=None, key=None):
+    # store `payload` under `key`, by default the argument_hash of its
+    # content, and return the key. a value computed again after its entry
+    # expired is stored under a key derived again, so that an old key never
+    # holds different content
+    if key is None:
+        key = 'intermediate-' + argument_hash(payload)
+    cache.set(key, payload, timeout=timeout)
+    return key
+
+
+class InvalidationBus(object):
+    # broadcasts the invalidations of near cache entries to every process:
+    # over redis pub/sub with a `redis_url`, otherwise by appending them to
+    # the log file `log_path` that every process tails (which only reaches
+    # the processes of a single machine)
+
+    def __init__(self, redis_url=None, log_path=DEFAULT_INVALIDATION_LOG,
+                 channel=INVALIDATION_CHANNEL):
+        self.redis_url = redis_url
+        self.log_path = log_path
+        self.channel = channel
+        # namespace -> function that drops the local copies of a key
+        self.invalidators = {}
+        self.client = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def sender(self):
+        return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    def redis(self):
+        # one client (and connection pool) for every message. the pool
+        # opens new connections in a forked process by itself
+        if self.client is None:
+            self.client = redis.from_url(self.redis_url)
+        return self.client
+
+    def register(self, namespace, invalidate_local):
+        self.invalidators[namespace] = invalidate_local
+
+    def publish(self, namespace, key=None):
+        # key=None invalidates the whole namespace
+        message = json.dumps({'namespace': namespace, 'key': key,
+                              'sender': self.sender()})
+        if self.redis_url is not None:
+            self.redis().publish(self.channel, message)
+        else:
+            self.append(message + '\n')
+
+    def append(self, line):
+        # a single write to a file opened with O_APPEND isn't interleaved with
+        # the writes of other processes. the lock keeps the log from being
+        # rotated between opening it and writing to it
+        make_parent_dir(self.log_path)
+        while True:
+            log = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            try:
+                fcntl.flock(log, fcntl.LOCK_EX)
+                if not same_file(log, self.log_path):
+                    # rotated since it was opened
+                    continue
+                os.write(log, line.encode('utf-8'))
+                if os.fstat(log).st_size > INVALIDATION_LOG_BYTES:
+                    # the listeners finish reading the old log first
+                    os.rename(self.log_path, self.log_path + '.1')
+                return
+            finally:
+                os.close(log)
+
+    def apply(self, message):
+        try:
+            message = json.loads(message)
+            # this process has already dropped its own copies
+            if message['sender'] == self.sender():
+                return
+            invalidate_local = self.invalidators.get(message['namespace'])
+            if invalidate_local is not None:
+                invalidate_local(message['key'])
+        except Exception:
+            logger.exception('Failed to apply the invalidation %r', message)
+
+    def apply_missed(self):
+        # messages may have been missed, drop every local copy
+        for invalidate_local in list(self.invalidators.values()):
+            invalidate_local(None)
+
+    def listen(self):
+        if self.redis_url is None:
+            self.tail()
+            return
+
+        delay = RECONNECT_MIN_DELAY
+        connected = False
+        while True:
+            pubsub = self.redis().pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                if connected:
+                    self.apply_missed()
+                connected = True
+                delay = RECONNECT_MIN_DELAY
+                for message in pubsub.listen():
+                    self.apply(message['data'])
+            except (redis.RedisError, OSError):
+                logger.warning('Lost the invalidation channel, subscribing again '
+                               'in %s seconds', delay, exc_info=True)
+                time.sleep(delay)
+                delay = min(2 * delay, RECONNECT_MAX_DELAY)
+            finally:
+                pubsub.close()
+
+    def tail(self):
+        # tail the log, starting from its current end, and follow it when
+        # it's rotated
+        make_parent_dir(self.log_path)
+        log = open(self.log_path, 'a+')
+        log.seek(0, os.SEEK_END)
+        pending = ''
+        while True:
+            pending += log.readline()
+            if pending.endswith('\n'):
+                self.apply(pending)
+                pending = ''
+                continue
+            if not same_file(log.fileno(), self.log_path):
+                # rotated: read the rest of the old log, then the new one
+                # from its start
+                for line in (pending + log.read()).splitlines(True):
+                    if line.endswith('\n'):
+                        self.apply(line)
+                pending = ''
+                log.close()
+                log = open(self.log_path, 'a+')
+                log.seek(0)
+                continue
+            time.sleep(INVALIDATION_POLL_INTERVAL)
+
+    def start(self):
+        # once per process. the pid changes when a worker is forked
+        # from a parent that had already started its own listener
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                thread = threading.Thread(target=self.listen)
+                thread.daemon = True
+                thread.start()
+
+
+def same_file(fd, path):
+    # whether the open file `fd` is still the file at `path`
+    try:
+        return os.fstat(fd).st_ino == os.stat(path).st_ino
+    except OSError:
+        return False
+
+
+def make_parent_dir(path):
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class NearCache(object):
+    # the version stamps and the local copies of the values memoized in the
+    # flask_caching Cache `cache`, see Near Cache above
+
+    def __init__(self, cache, bus=None):
+        self.cache = cache
+        self.bus = bus
+
+    def memoize(self, **kwargs):
+        # cache.memoize(**kwargs), keyed with stable_keys, that writes a new
+        # version stamp every time it computes and stores a value. the stamp is
+        # written after the value is stored, so a process that reads the new
+        # stamp can't read the old value along with it.
+        # `refresh(*args, **kwargs)` computes and stores a value again even if
+        # it's cached, through the same `response_filter`
+        make_name = kwargs.get('make_name')
+        response_filter = kwargs.pop('response_filter', None)
+
+        def decorator(function):
+            computed = threading.local()
+            signature = inspect.signature(function)
+
+            @functools.wraps(function)
+            def compute(*args, **kwargs):
+                computed.value = True
+                return function(*args, **kwargs)
+
+            def store(value):
+                computed.stored = response_filter is None or response_filter(value)
+                return computed.stored
+
+            memoized = stable_keys(self.cache.memoize(
+                response_filter=store,
+                forced_update=lambda: getattr(computed, 'forced', False),
+                **kwargs)(compute))
+
+            @functools.wraps(memoized)
+            def wrapper(*args, **kwargs):
+                # memoize calls the function without the response_filter when
+                # the cache fails or is bypassed, so nothing is stored then
+                computed.value = False
+                computed.stored = False
+                value = memoized(*args, **kwargs)
+                if computed.value:
+                    if computed.stored:
+                        self.stamp(wrapper, args, kwargs)
+                    else:
+                        # the new value isn't stored, so neither is the
+                        # old one: it mustn't be served under a new stamp
+                        self.forget(wrapper, args, kwargs)
+                return value
+
+            def refresh(*args, **kwargs):
+                computed.forced = True
+                try:
+                    return wrapper(*args, **kwargs)
+                finally:
+                    computed.forced = False
+
+            def stamp_key(args, kwargs):
+                # versioned with make_name and normalized with bind_arguments
+                # like the memoized keys
+                name = function.__name__
+                if make_name is not None:
+                    name = make_name(name)
+                return 'stamp-{}-{}'.format(name, argument_hash(
+                    bind_arguments(signature, args, kwargs)))
+
+            wrapper.refresh = refresh
+            wrapper.stamp_key = stamp_key
+            return wrapper
+        return decorator
+
+    def stamp(self, memoized, args, kwargs):
+        # record that a new value of memoized(*args, **kwargs) was stored: a
+        # random id, and the time to tell the age of the value. the other
+        # processes are told to drop their copies of the old value
+        key = memoized.stamp_key(args, kwargs)
+        self.cache.set(key, (uuid.uuid4().hex, time.time()), timeout=0)
+        if self.bus is not None:
+            self.bus.publish(memoized.__name__, key)
+
+    def forget(self, memoized, args, kwargs):
+        # delete the stored value of memoized(*args, **kwargs) and its stamp
+        key = memoized.stamp_key(args, kwargs)
+        self.cache.delete_many(
+            memoized.make_cache_key(memoized.uncached, *args, **kwargs), key)
+        if self.bus is not None:
+            self.bus.publish(memoized.__name__, key)
+        return key
+
+    def __call__(self, maxsize=32, check_interval=1.0, decode=None):
+        # keep the last `maxsize` values in this process, keyed by the function
+        # and its arguments like the memoized entries. a local value is trusted
+        # for `check_interval` seconds, then it's only used again if the version
+        # stamp in the shared cache hasn't changed.
+        # `decode` is applied once to values read from the shared cache.
+        # place the decorator above @near_cache.memoize(), or above a decorator
+        # with a `check_stamp(args, kwargs, stamp)` that decides whether a local
+        # value is too old (see stale_while_revalidate in app.22.py)
+        cache = self.cache
+        bus = self.bus
+
+        def decorator(memoized):
+            check_stamp = getattr(memoized, 'check_stamp', None)
+            local = collections.OrderedDict()
+            lock = threading.Lock()
+            generation_key = 'stamp-' + memoized.__name__
+
+            def invalidate_local(key):
+                with lock:
+                    if key is None:
+                        local.clear()
+                    else:
+                        local.pop(key, None)
+
+            if bus is not None:
+                bus.register(memoized.__name__, invalidate_local)
+
+            @functools.wraps(memoized)
+            def wrapper(*args, **kwargs):
+                if bus is not None:
+                    bus.start()
+                key = memoized.stamp_key(args, kwargs)
+                with lock:
+                    entry = local.get(key)
+                if entry is not None and time.time() - entry['checked'] < check_interval:
+                    return entry['value']
+
+                # the stamp of the value, and the generation of the whole function
+                stamp, generation = cache.get_many(key, generation_key)
+                if generation is None:
+                    cache.add(generation_key, uuid.uuid4().hex, timeout=0)
+                    generation = cache.get(generation_key)
+                if stamp is not None:
+                    stamp = (stamp, generation)
+                if entry is not None and stamp is not None and entry['stamp'] == stamp and \
+                        (check_stamp is None or check_stamp(args, kwargs, stamp[0])):
+                    entry['checked'] = time.time()
+                    return entry['value']
+
+                value = memoized(*args, **kwargs)
+                if decode is not None:
+                    value = decode(value)
+                # without a stamp there's no way to tell when the shared value
+                # changes, so the value isn't kept locally
+                if stamp is not None:
+                    with lock:
+                        local[key] = {'stamp': stamp, 'value': value,
+                                      'checked': time.time()}
+                        local.move_to_end(key)
+                        while len(local) > maxsize:
+                            local.popitem(last=False)
+                return value
+
+            def invalidate(*args, **kwargs):
+                # delete the value from both tiers, or every value of the
+                # function when it's called without arguments,
+                # and tell the other processes to drop their local copies
+                if not (args or kwargs):
+                    cache.delete_memoized(memoized)
+                    cache.set(generation_key, uuid.uuid4().hex, timeout=0)
+                    invalidate_local(None)
+                    if bus is not None:
+                        bus.publish(memoized.__name__)
+                else:
+                    invalidate_local(self.forget(memoized, args, kwargs))
+
+            wrapper.invalidate = invalidate
+            return wrapper
+        return decorator
+
+
+def modified_time(path):
+    # 0 for an entry that was removed meanwhile
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+
+class SharedMemoryCache(BaseCache):
+
+    def __init__(self, directory=DEFAULT_DIR, threshold=500, default_timeout=300):
+        super(SharedMemoryCache, self).__init__(default_timeout)
+        self._directory = directory
+        self._threshold = threshold
+        self._writes = 0
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(dict(directory=config.get('CACHE_DIR') or DEFAULT_DIR,
+                           threshold=config['CACHE_THRESHOLD']))
+        return cls(*args, **kwargs)
+
+    def _path(self, key):
+        return os.path.join(self._directory,
+                            hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _entries(self):
+        return [os.path.join(self._directory, name)
+                for name in os.listdir(self._directory) if len(name) == 40]
+
+    def _lock(self):
+        # serializes add, inc and dec across processes
+        lock_file = open(os.path.join(self._directory, 'lock'), 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return 0 if timeout == 0 else time.time() + timeout
+
+    def _encode(self, value):
+        buffers = []
+        offset = 0
+        if isinstance(value, pd.DataFrame):
+            columns = []
+            for i in range(value.shape[1]):
+                description, offset = describe_array(
+                    array_values(value.iloc[:, i]), buffers, offset)
+                columns.append(description)
+            if isinstance(value.index, pd.RangeIndex):
+                index = {'range': (value.index.start, value.index.stop,
+                                   value.index.step)}
+            else:
+                index, offset = describe_array(array_values(value.index),
+                                               buffers, offset)
+            header = {'columns': columns,
+                      'names': list(value.columns), 'index': index,
+                      'index_name': value.index.name}
+        elif isinstance(value, bytes):
+            buffers.append((0, np.frombuffer(value, dtype=np.uint8)))
+            offset = len(value)
+            header = {'bytes': offset}
+        else:
+            header = {'value': value}
+        header = pickle.dumps(header, pickle.HIGHEST_PROTOCOL)
+        # the buffers start after the header, aligned
+        start = ENTRY.size + len(header)
+        start += -start % ALIGNMENT
+        return header, start, buffers, offset
+
+    def _write(self, key, value, timeout):
+        header, start, buffers, end = self._encode(value)
+        path = self._path(key)
+        # written next to the entry and renamed, so readers never see
+        # a partial entry
+        temporary = '{}.{}'.format(path, uuid.uuid4().hex)
+        with open(temporary, 'wb') as f:
+            f.write(ENTRY.pack(len(header), self._expires(timeout)))
+            f.write(header)
+            for offset, values in buffers:
+                f.seek(start + offset)
+                f.write(values.view(np.uint8))
+            # empty buffers at the end are still inside the file
+            f.truncate(start + end)
+        os.rename(temporary, path)
+        # listing the entries costs as much as the write, so they're only
+        # counted every few writes
+        self._writes += 1
+        if self._writes >= max(1, self._threshold // PRUNE_FRACTION):
+            self._writes = 0
+            self._prune()
+        return True
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                # copy-on-write: the frames can be modified, the pages that are
+                # written to are copied for this process only
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (IOError, OSError, ValueError):
+            # missing (or empty)
+            return None, False
+        length, expires = ENTRY.unpack_from(mapped)
+        if expires and expires < time.time():
+            return None, False
+        header = pickle.loads(mapped[ENTRY.size:ENTRY.size + length])
+        if 'value' in header:
+            return header['value'], True
+
+        start = ENTRY.size + length
+        start += -start % ALIGNMENT
+        buffer = memoryview(mapped)[start:]
+        if 'bytes' in header:
+            return buffer[:header['bytes']], True
+        columns = [read_array(buffer, description)
+                   for description in header['columns']]
+        if 'range' in header['index']:
+            index = pd.RangeIndex(*header['index']['range'])
+        else:
+            index = pd.Index(read_array(buffer, header['index']), copy=False)
+        index.name = header['index_name']
+        # a column per block, so that pandas doesn't copy them into one
+        df = pd.DataFrame(dict(enumerate(columns)), index=index, copy=False)
+        df.columns = header['names']
+        return df, True
+
+    def _prune(self):
+        entries = self._entries()
+        if len(entries) <= self._threshold:
+            return
+        # the oldest entries first
+        entries.sort(key=modified_time)
+        for path in entries[:len(entries) - self._threshold]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, key):
+        return self._read(key)[0]
+
+    def has(self, key):
+        # only reads the expiry, not the value
+        try:
+            with open(self._path(key), 'rb') as f:
+                length, expires = ENTRY.unpack(f.read(ENTRY.size))
+        except (IOError, OSError, struct.error):
+            return False
+        return not expires or expires >= time.time()
+
+    def set(self, key, value, timeout=None):
+        return self._write(key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        lock_file = self._lock()
+        try:
+            if self.has(key):
+                return False
+            return self._write(key, value, timeout)
+        finally:
+            lock_file.close()
+
+    def _increment(self, key, delta):
+        lock_file = self._lock()
+        try:
+            value = (self.get(key) or 0) + delta
+            self._write(key, value, timeout=0)
+            return value
+        finally:
+            lock_file.close()
+
+    def inc(self, key, delta=1):
+        return self._increment(key, delta)
+
+    def dec(self, key, delta=1):
+        return self._increment(key, -delta)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+            return True
+        except OSError:
+            return False
+
+    def clear(self):
+        for path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return True
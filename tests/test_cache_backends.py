@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""
+Round trips of values through the backends and codecs of cache_backends.py
+
+    $ python -m pytest tests
+"""
+
+import os
+import pickle
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import flask
+import plotly.graph_objects as go
+import pytest
+from flask_caching import Cache
+from flask_caching.backends.filesystemcache import FileSystemCache
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cache_backends import (  # noqa: E402
+    CompressedFileSystemCache, NearCache, SharedMemoryCache, argument_hash,
+    compress, decode_frame, encode_frame)
+
+N_ROWS = 5
+
+COLUMNS = {
+    'int': lambda: np.arange(N_ROWS, dtype=np.int64),
+    'small-int': lambda: np.arange(N_ROWS, dtype=np.int8),
+    'uint': lambda: np.arange(N_ROWS, dtype=np.uint32),
+    'float': lambda: np.linspace(0, 1, N_ROWS),
+    'bool': lambda: np.arange(N_ROWS) % 2 == 0,
+    'complex': lambda: np.arange(N_ROWS) * (1 + 2j),
+    'datetime': lambda: pd.date_range('2020-01-01', periods=N_ROWS, freq='h'),
+    'datetime-us': lambda: pd.date_range(
+        '2020-01-01', periods=N_ROWS, freq='h', unit='us'),
+    'datetime-tz': lambda: pd.date_range(
+        '2020-01-01', periods=N_ROWS, freq='h', tz='US/Eastern', unit='us'),
+    'timedelta': lambda: pd.to_timedelta(np.arange(N_ROWS), unit='s'),
+    'period': lambda: pd.period_range('2020-01', periods=N_ROWS, freq='M'),
+    'category': lambda: pd.Categorical(['a', 'b'] * 2 + ['a']),
+    'object': lambda: np.array(['a', 1, None, 2.5, 'e'], dtype=object),
+    'string': lambda: pd.array(['a', 'b', None, 'd', 'e'], dtype='string'),
+    'nullable-int': lambda: pd.array([1, None, 3, 4, 5], dtype='Int64'),
+    'nullable-bool': lambda: pd.array([True, None, False, True, True],
+                                      dtype='boolean'),
+    'interval': lambda: pd.interval_range(0, N_ROWS),
+}
+
+INDEXES = {
+    'range': lambda: pd.RangeIndex(10, 10 + 2 * N_ROWS, 2, name='i'),
+    'int': lambda: pd.Index(np.arange(N_ROWS) * 3, name='i'),
+    'string': lambda: pd.Index(list('vwxyz'), name='i'),
+    'datetime-tz': lambda: pd.date_range(
+        '2020-01-01', periods=N_ROWS, freq='D', tz='Europe/Paris', name='i'),
+}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SharedMemoryCache(str(tmp_path / 'shared-memory'), threshold=100)
+
+
+def frame(column):
+    return pd.DataFrame({'values': COLUMNS[column](), 'x': np.arange(N_ROWS)})
+
+
+@pytest.mark.parametrize('column', sorted(COLUMNS))
+def test_shared_memory_column(cache, column):
+    df = frame(column)
+    cache.set('df', df)
+    pd.testing.assert_frame_equal(cache.get('df'), df)
+
+
+@pytest.mark.parametrize('index', sorted(INDEXES))
+def test_shared_memory_index(cache, index):
+    df = pd.DataFrame({'x': np.arange(N_ROWS)}, index=INDEXES[index]())
+    cache.set('df', df)
+    pd.testing.assert_frame_equal(cache.get('df'), df)
+
+
+@pytest.mark.parametrize('column', sorted(COLUMNS))
+def test_encode_frame_column(column):
+    df = frame(column)
+    pd.testing.assert_frame_equal(decode_frame(encode_frame(df)), df)
+
+
+@pytest.mark.parametrize('value', [b'', b'\0cz raw bytes', 'text', 42, None,
+                                   {'a': [1, 2]}, (1, 'b')])
+def test_shared_memory_value(cache, value):
+    cache.set('value', value)
+    stored = cache.get('value')
+    if isinstance(value, bytes):
+        stored = bytes(stored)
+    assert stored == value
+    assert cache.has('value')
+
+
+def test_shared_memory_frames_are_copy_on_write(cache):
+    cache.set('df', pd.DataFrame({'x': np.arange(N_ROWS, dtype=float)}))
+    df = cache.get('df')
+    df.loc[0, 'x'] = 9
+    assert df['x'][0] == 9
+    # the cached entry doesn't change
+    assert cache.get('df')['x'][0] == 0
+
+
+def test_shared_memory_prune_of_removed_entries(tmp_path, monkeypatch):
+    cache = SharedMemoryCache(str(tmp_path / 'shared-memory'), threshold=40)
+    for i in range(40):
+        cache.set('key-{}'.format(i), i)
+    removed = cache._entries()[0]
+    getmtime = os.path.getmtime
+
+    def removed_meanwhile(path):
+        # as if another process pruned the entry after it was listed
+        if path == removed and os.path.exists(path):
+            os.remove(path)
+        return getmtime(path)
+
+    monkeypatch.setattr(os.path, 'getmtime', removed_meanwhile)
+    cache.set('key-40', 40)
+    assert cache.get('key-40') == 40
+
+
+def test_shared_memory_expiry(cache):
+    cache.set('forever', 1, timeout=0)
+    cache.set('expired', 1, timeout=1)
+    time.sleep(1.1)
+    assert cache.has('forever') and cache.get('forever') == 1
+    assert not cache.has('expired') and cache.get('expired') is None
+    assert not cache.has('missing')
+    assert cache.add('expired', 2) and cache.get('expired') == 2
+    assert not cache.add('forever', 2)
+
+
+def test_shared_memory_prune(tmp_path):
+    cache = SharedMemoryCache(str(tmp_path / 'shared-memory'), threshold=40)
+    for i in range(200):
+        cache.set('key-{}'.format(i), i)
+    assert len(cache._entries()) <= 40 + 40 // 20
+    # the latest entries are kept
+    assert cache.get('key-199') == 199
+
+
+@pytest.mark.parametrize('value', [
+    b'\0cz raw bytes that look compressed',
+    b'\0cz' + b'x' * 10000,
+    pd.DataFrame({'x': np.zeros(10000), 'y': ['a'] * 10000}),
+    np.random.RandomState(0).bytes(10000),
+    'small',
+    None,
+])
+def test_compressed_file_system_value(tmp_path, value):
+    cache = CompressedFileSystemCache(str(tmp_path / 'compressed'))
+    cache.set('value', value)
+    stored = cache.get('value')
+    if isinstance(value, pd.DataFrame):
+        pd.testing.assert_frame_equal(stored, value)
+    else:
+        assert stored == value
+
+
+def test_compressed_file_system_reads_file_system_entries(tmp_path):
+    directory = str(tmp_path / 'compressed')
+    FileSystemCache(directory).set('plain', {'a': 1})
+    FileSystemCache(directory).set('old', compress(
+        pickle.dumps(b'y' * 10000, pickle.HIGHEST_PROTOCOL)))
+    cache = CompressedFileSystemCache(directory)
+    assert cache.get('plain') == {'a': 1}
+    assert cache.get('old') == b'y' * 10000
+    assert cache.get('missing') is None
+
+
+def test_compressed_file_system_expiry(tmp_path):
+    cache = CompressedFileSystemCache(str(tmp_path / 'compressed'))
+    cache.set('expired', b'z' * 10000, timeout=1)
+    assert cache.has('expired')
+    time.sleep(1.1)
+    assert cache.get('expired') is None and not cache.has('expired')
+
+
+def test_argument_hash_of_unhashable_objects():
+    df = pd.DataFrame({'a': [[1, 2], [3]], 'b': [{'c': 1}, None]})
+    assert argument_hash(df) == argument_hash(df.copy())
+    assert argument_hash(df) != argument_hash(df.iloc[::-1])
+
+
+def test_argument_hash_of_figures():
+    y = np.zeros(5000)
+    changed = y.copy()
+    changed[2500] = 1
+    figure = go.Figure(go.Scatter(y=y))
+    assert argument_hash(figure) == argument_hash(go.Figure(go.Scatter(y=y)))
+    # repr() elides the middle of long arrays
+    assert argument_hash(figure) != argument_hash(go.Figure(go.Scatter(y=changed)))
+
+
+def test_argument_hash_of_unpicklable_objects():
+    with pytest.raises(TypeError):
+        argument_hash(threading.Lock())
+
+
+def test_near_cache_stamp_keys():
+    app = flask.Flask(__name__)
+    near_cache = NearCache(Cache(app, config={
+        'CACHE_TYPE': 'flask_caching.backends.SimpleCache'}))
+    computed = []
+
+    @near_cache()
+    @near_cache.memoize()
+    def f(x, y=2):
+        computed.append(x)
+        return x + y
+
+    with app.app_context():
+        assert f(1) == f(x=1) == f(1, y=2) == 3
+        assert computed == [1]
+        assert f.stamp_key((1,), {}) == f.stamp_key((), {'x': 1, 'y': 2})
+        assert near_cache.cache.get(f.stamp_key((1,), {})) is not None
+
+
+def test_near_cache_bypassed_memoize():
+    app = flask.Flask(__name__)
+    near_cache = NearCache(Cache(app, config={
+        'CACHE_TYPE': 'flask_caching.backends.SimpleCache'}))
+
+    @near_cache.memoize(unless=lambda: True)
+    def f(x):
+        return x
+
+    with app.app_context():
+        # computed without storing it, so without a stamp
+        assert f(1) == 1
+        assert near_cache.cache.get(f.stamp_key((1,), {})) is None
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+Skipping unchanged outputs of multi-output callbacks
+
+A multi-output callback sends every output back to the browser on every call,
+even the ones whose value didn't change. Register it with skip_unchanged_outputs
+instead of app.callback to send only the outputs that changed:
+
+    @skip_unchanged_outputs(
+        app, 'table-hashes',
+        [Output('square', 'children'), Output('cube', 'children')],
+        [Input('num-multi', 'value')])
+    def update_table(x):
+        return x**2, x**3
+
+and add the store that keeps the hashes to the layout:
+
+    dcc.Store(id='table-hashes')
+
+Every output is hashed as the JSON that Dash sends for it (serialized with
+plotly's PlotlyJSONEncoder, like Dash does), so two outputs hash the same only
+when the browser would receive the same thing. The hashes are returned to the browser in the store, together with
+the outputs, and the store is sent back as a State on the next call. An output
+whose hash is the same as the one in the store is replaced with dash.no_update,
+and when every output is unchanged nothing is sent.
+
+The hashes describe what the browser actually shows: they are updated by the same
+response as the outputs, so a response that the browser drops (because a newer
+one was requested) drops its hashes too. Nothing is kept on the server, so every
+process of the app can handle every call.
+"""
+
+import functools
+import hashlib
+import json
+
+import dash
+import plotly
+from dash.dependencies import Output, State
+from dash.exceptions import PreventUpdate
+
+
+def output_hash(value):
+    # the hash of the JSON that Dash sends for `value`
+    return hashlib.sha1(json.dumps(
+        value, cls=plotly.utils.PlotlyJSONEncoder).encode('utf-8')).hexdigest()
+
+
+def skip_unchanged_outputs(app, hashes_id, outputs, inputs, state=None):
+    # like app.callback(outputs, inputs, state), with one more output and
+    # state: the dcc.Store `hashes_id`, which holds the hashes of the
+    # outputs that the browser has
+    def decorator(callback):
+        @app.callback(list(outputs) + [Output(hashes_id, 'data')],
+                      list(inputs),
+                      list(state or []) + [State(hashes_id, 'data')])
+        @functools.wraps(callback)
+        def wrapper(*args):
+            previous = args[-1] or [None] * len(outputs)
+            values = list(callback(*args[:-1]))
+            hashes = [
+                old if value is dash.no_update else output_hash(value)
+                for value, old in zip(values, previous)
+            ]
+            if hashes == previous:
+                raise PreventUpdate
+            return [
+                dash.no_update if new == old else value
+                for value, new, old in zip(values, hashes, previous)
+            ] + [hashes]
+        return wrapper
+    return decorator